@@ -13,5 +13,11 @@ CREATE TABLE users (
 CREATE TABLE books (
     id SERIAL PRIMARY KEY,
     title VARCHAR(100),
-    author VARCHAR(100)
+    author VARCHAR(100),
+    total_copies INTEGER NOT NULL DEFAULT 1,
+    available_copies INTEGER NOT NULL DEFAULT 1
+        CHECK (available_copies BETWEEN 0 AND total_copies),
+    catalog_key BIGINT
 );
+
+CREATE INDEX ix_books_catalog_key ON books (catalog_key);
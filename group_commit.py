@@ -0,0 +1,163 @@
+import os
+import queue
+import sqlite3
+import threading
+import time
+
+# upper bounds of the batch-size and commit-latency histogram buckets
+BATCH_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256, 512)
+LATENCY_BUCKETS_MS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000)
+
+
+class _Pending:
+    __slots__ = ("sql", "params", "done", "rowid", "error")
+
+    def __init__(self, sql, params):
+        self.sql = sql
+        self.params = params
+        self.done = threading.Event()
+        self.rowid = None
+        self.error = None
+
+
+def _bucket(buckets, value):
+    for i, bound in enumerate(buckets):
+        if value <= bound:
+            return i
+    return len(buckets)
+
+
+class GroupCommitWriter:
+    """Funnel one worker's INSERTs through a single writer thread.
+
+    Requests hand their statement to submit() and block. The writer drains
+    the queue for up to max_delay seconds or max_rows statements, runs them
+    in one transaction (each under its own savepoint, so a bad row fails
+    alone) and commits once. Under a burst, hundreds of requests share one
+    write lock acquisition and one fsync instead of queueing on
+    "database is locked".
+    """
+
+    def __init__(self, database, setup=None, max_rows=200, max_delay=0.005, timeout=30.0):
+        self.database = database
+        self.setup = setup
+        self.max_rows = max_rows
+        self.max_delay = max_delay
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._queue = None
+        self._pid = None
+        self._stats = {"batches": 0, "rows": 0, "failed_rows": 0, "failed_batches": 0,
+                       "max_batch": 0, "commit_seconds": 0.0}
+        self._batch_hist = [0] * (len(BATCH_BUCKETS) + 1)
+        self._latency_hist = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+
+    def _ensure_started(self):
+        # the writer thread does not survive a fork, so each worker starts its own
+        with self._lock:
+            if self._pid != os.getpid():
+                self._queue = queue.Queue()
+                self._pid = os.getpid()
+                threading.Thread(target=self._run, args=(self._queue,),
+                                 name="group-commit", daemon=True).start()
+            return self._queue
+
+    def submit(self, sql, params=()):
+        """Queue one INSERT, wait until its batch has committed and return its rowid."""
+        item = _Pending(sql, params)
+        self._ensure_started().put(item)
+        if not item.done.wait(self.timeout):
+            raise TimeoutError(f"group commit to {self.database} took longer than {self.timeout}s")
+        if item.error is not None:
+            raise item.error
+        return item.rowid
+
+    def _connect(self):
+        con = sqlite3.connect(self.database, isolation_level=None, check_same_thread=False)
+        if self.setup is not None:
+            self.setup(con)
+        return con
+
+    def _run(self, pending):
+        con = None
+        while True:
+            batch = [pending.get()]
+            deadline = time.monotonic() + self.max_delay
+            while len(batch) < self.max_rows:
+                remaining = deadline - time.monotonic()
+                try:
+                    batch.append(pending.get(timeout=remaining) if remaining > 0
+                                 else pending.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                if con is None:
+                    con = self._connect()
+                self._flush(con, batch)
+            except Exception as e:
+                # no connection, or it broke so badly that ROLLBACK failed: fail
+                # this batch, reconnect for the next one and keep the thread alive
+                for item in batch:
+                    item.rowid = None
+                    item.error = item.error or e
+                with self._lock:
+                    self._stats["failed_batches"] += 1
+                    self._stats["failed_rows"] += len(batch)
+                if con is not None:
+                    try:
+                        con.close()
+                    except sqlite3.Error:
+                        pass
+                    con = None
+            finally:
+                # whatever happened, nobody waits out the timeout
+                for item in batch:
+                    item.done.set()
+
+    def _flush(self, con, batch):
+        started = time.monotonic()
+        failed = 0
+        try:
+            con.execute("BEGIN IMMEDIATE")
+            for item in batch:
+                con.execute("SAVEPOINT row")
+                try:
+                    item.rowid = con.execute(item.sql, item.params).lastrowid
+                except sqlite3.Error as e:
+                    con.execute("ROLLBACK TO row")
+                    item.error = e
+                    failed += 1
+                con.execute("RELEASE row")
+            con.execute("COMMIT")
+            batch_failed = False
+        except sqlite3.Error as e:
+            if con.in_transaction:
+                con.execute("ROLLBACK")
+            for item in batch:
+                item.rowid = None
+                item.error = item.error or e
+            batch_failed = True
+        elapsed = time.monotonic() - started
+
+        with self._lock:
+            stats = self._stats
+            stats["batches"] += 1
+            stats["rows"] += len(batch)
+            stats["failed_rows"] += len(batch) if batch_failed else failed
+            stats["failed_batches"] += batch_failed
+            stats["max_batch"] = max(stats["max_batch"], len(batch))
+            stats["commit_seconds"] += elapsed
+            self._batch_hist[_bucket(BATCH_BUCKETS, len(batch))] += 1
+            self._latency_hist[_bucket(LATENCY_BUCKETS_MS, elapsed * 1000)] += 1
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            batches = stats["batches"] or 1
+            stats["avg_batch"] = stats["rows"] / batches
+            stats["avg_commit_ms"] = stats.pop("commit_seconds") * 1000 / batches
+            labels = [str(b) for b in BATCH_BUCKETS] + ["+Inf"]
+            stats["batch_size_histogram"] = dict(zip(labels, self._batch_hist))
+            labels = [str(b) for b in LATENCY_BUCKETS_MS] + ["+Inf"]
+            stats["commit_ms_histogram"] = dict(zip(labels, self._latency_hist))
+            return stats
@@ -1,13 +1,66 @@
-from flask import Flask, request, redirect, render_template_string
+from flask import (Flask, Response, request, redirect, render_template, jsonify,
+                   send_from_directory, stream_with_context)
 from flask_sqlalchemy import SQLAlchemy  # pyright: ignore[reportMissingImports]
+from sqlalchemy.schema import CreateIndex
+from werkzeug.middleware.proxy_fix import ProxyFix
+import click
+import csv
+import io
+import json
 import os
+import re
+import tempfile
+import time
+import uuid
+import sqlite_profile
+import template_registry
+from data_version import DataVersionWatcher
+from conditional import conditional
+from group_commit import GroupCommitWriter
+from metrics import Metrics
+from rate_limit import RateLimiter
+from sql_hooks import QueryHooks
+from sql_trace import QueryTracer
+from server_timing import ServerTiming
 
 app = Flask(__name__)
 
 # DB config
 basedir = os.path.abspath(os.path.dirname(__file__))
-app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite:///" + os.path.join(basedir, "registrations.db")
+app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite:///" + os.environ.get(
+    "REGISTRATIONS_DB", os.path.join(basedir, "registrations.db"))
 app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+app.config["SQLITE_PROFILE"] = os.environ.get("SQLITE_PROFILE", "throughput")
+app.config["JINJA_BYTECODE_CACHE"] = os.environ.get("JINJA_BYTECODE_CACHE")
+app.config["GROUP_COMMIT"] = os.environ.get("GROUP_COMMIT", "0") == "1"
+app.config["GROUP_COMMIT_MAX_ROWS"] = int(os.environ.get("GROUP_COMMIT_MAX_ROWS", 200))
+app.config["GROUP_COMMIT_MAX_DELAY_MS"] = float(os.environ.get("GROUP_COMMIT_MAX_DELAY_MS", 5))
+# login/registration throttling; buckets shared by all workers through RATE_LIMIT_DB
+app.config["RATE_LIMIT"] = os.environ.get("RATE_LIMIT", "1") == "1"
+app.config["RATE_LIMIT_DB"] = os.environ.get(
+    "RATE_LIMIT_DB", os.path.join(tempfile.gettempdir(), "registrations-ratelimit.db"))
+app.config["RATE_LIMIT_IP"] = os.environ.get("RATE_LIMIT_IP", "20/60")
+app.config["RATE_LIMIT_ACCOUNT"] = os.environ.get("RATE_LIMIT_ACCOUNT", "5/60")
+# reverse proxies in front of the app that append to X-Forwarded-For; the limiter
+# keys on the client address they report (0 = clients connect directly)
+app.config["TRUSTED_PROXIES"] = int(os.environ.get("TRUSTED_PROXIES", 0))
+# /metrics; every worker of one gunicorn master must share METRICS_DIR ("" = per process)
+app.config["METRICS_DIR"] = os.environ.get(
+    "METRICS_DIR", os.path.join(tempfile.gettempdir(), "registrations-metrics"))
+# SQL log: statements slower than SQL_SLOW_MS, and templates run more than SQL_REPEAT_LIMIT times per request
+app.config["SQL_SLOW_MS"] = float(os.environ.get("SQL_SLOW_MS", 100))
+app.config["SQL_REPEAT_LIMIT"] = int(os.environ.get("SQL_REPEAT_LIMIT", 10))
+# Server-Timing header (db, render, session, total); off by default, it exposes timings to clients
+app.config["SERVER_TIMING"] = os.environ.get("SERVER_TIMING", "0") == "1"
+
+# /list pagination
+app.config["LIST_PAGE_SIZE"] = int(os.environ.get("LIST_PAGE_SIZE", 50))
+app.config["LIST_MAX_PAGE_SIZE"] = int(os.environ.get("LIST_MAX_PAGE_SIZE", 500))
+# rows fetched per query by /export.csv and /export.jsonl
+app.config["EXPORT_CHUNK_SIZE"] = int(os.environ.get("EXPORT_CHUNK_SIZE", 1000))
+# bulk CSV import: rows per executemany/commit, and where rejected-row reports go
+app.config["IMPORT_BATCH_SIZE"] = int(os.environ.get("IMPORT_BATCH_SIZE", 5000))
+app.config["IMPORT_REPORT_DIR"] = os.environ.get("IMPORT_REPORT_DIR", os.path.join(basedir, "import_reports"))
 
 db = SQLAlchemy(app)
 
@@ -15,17 +68,81 @@ db = SQLAlchemy(app)
 class Registration(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100))
-    email = db.Column(db.String(100))
+    email = db.Column(db.String(100), index=True)
     phone = db.Column(db.String(20))
     gender = db.Column(db.String(10))
 
+# /list filters and sorts; each combination has an index to seek on
+NAME_KEY = Registration.name.collate("NOCASE")
+# literal SQL, so filters match the expression index exactly
+EMAIL_DOMAIN = db.literal_column("lower(substr(email, instr(email, '@') + 1))")
+db.Index("ix_registration_name", NAME_KEY, Registration.id)
+db.Index("ix_registration_gender", Registration.gender, Registration.id)
+db.Index("ix_registration_gender_name", Registration.gender, NAME_KEY, Registration.id)
+db.Index("ix_registration_domain", EMAIL_DOMAIN, Registration.id)
+db.Index("ix_registration_domain_name", EMAIL_DOMAIN, NAME_KEY, Registration.id)
+db.Index("ix_registration_phone", Registration.phone, Registration.id)
+db.Index("ix_registration_phone_name", Registration.phone, NAME_KEY, Registration.id)
+
+metrics = Metrics("registrations", app.config["METRICS_DIR"])
+query_hooks = QueryHooks()
+query_tracer = QueryTracer(app.config["SQL_SLOW_MS"], app.config["SQL_REPEAT_LIMIT"])
+query_tracer.init_app(app)
+query_hooks.subscribe(metrics.record_query)
+query_hooks.subscribe(query_tracer.record_query)
+server_timing = ServerTiming()
+if app.config["SERVER_TIMING"]:
+    server_timing.init_app(app, query_hooks)
+
 with app.app_context():
-    db.create_all()
+    # before install(), whose check opens the first connection
+    query_hooks.instrument_engine(db.engine)
+    sqlite_profile.install(db.engine, app.config["SQLITE_PROFILE"])
+    with sqlite_profile.schema_setup(db.engine):
+        db.create_all()
+        # create_all() skips indexes on tables that already exist, and checkfirst
+        # cannot reflect expression indexes, so let SQLite skip existing ones
+        with db.engine.begin() as con:
+            for index in Registration.__table__.indexes:
+                con.execute(CreateIndex(index, if_not_exists=True))
+    # per-process caches subscribe to this to see other workers' commits
+    watcher = DataVersionWatcher(db.engine.url.database)
+    watcher.track("registration")
+    watcher.init_app(app)
+    # workers forked from this process (gunicorn --preload) open their own
+    db.engine.dispose()
+
+# with GROUP_COMMIT=1, registrations from concurrent requests share one transaction
+writer = None
+if app.config["GROUP_COMMIT"]:
+    writer = GroupCommitWriter(
+        watcher.database,
+        setup=lambda con: sqlite_profile.apply_profile(con, app.config["SQLITE_PROFILE"]),
+        max_rows=app.config["GROUP_COMMIT_MAX_ROWS"],
+        max_delay=app.config["GROUP_COMMIT_MAX_DELAY_MS"] / 1000,
+    )
+
+limiter = RateLimiter(app.config["RATE_LIMIT_DB"], app.config["RATE_LIMIT_IP"],
+                      app.config["RATE_LIMIT_ACCOUNT"])
+if app.config["TRUSTED_PROXIES"]:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=app.config["TRUSTED_PROXIES"])
+if app.config["RATE_LIMIT"]:
+    limiter.init_app(app)
+# after the limiter, so its hook goes in ahead of it and 429s are counted
+metrics.init_app(app)
 
 #ADD USER (STARTING PAGE)
 @app.route("/", methods=["GET", "POST"])
+@limiter.limit(account=lambda: request.form.get("email"))
 def add_user():
     if request.method == "POST":
+        if writer is not None:
+            writer.submit(
+                "INSERT INTO registration (name, email, phone, gender) VALUES (?, ?, ?, ?)",
+                (request.form["name"], request.form["email"],
+                 request.form["phone"], request.form["gender"])
+            )
+            return redirect("/list")
         user = Registration(
             name=request.form["name"],
             email=request.form["email"],
@@ -36,7 +153,283 @@ def add_user():
         db.session.commit()
         return redirect("/list")
 
-    return render_template_string("""
+    return render_template("add.html")
+
+#LIST USERS
+def list_filters():
+    args = request.args
+    filters = {key: args.get(key, "").strip() for key in ("gender", "name", "domain", "phone")}
+    filters["sort"] = "name" if args.get("sort") == "name" else "id"
+    if filters["name"]:
+        # a name prefix is a range on the name indexes, which can only hand
+        # rows back in name order; id order would sort every match per page
+        filters["sort"] = "name"
+    return filters
+
+def filtered_registrations(filters):
+    query = Registration.query
+    if filters["gender"]:
+        query = query.filter(Registration.gender == filters["gender"])
+    if filters["name"]:
+        # prefix as a range, so it seeks in ix_registration_name
+        query = query.filter(NAME_KEY >= filters["name"], NAME_KEY < filters["name"] + "\U0010ffff")
+    if filters["domain"]:
+        query = query.filter(EMAIL_DOMAIN == filters["domain"].lstrip("@").lower())
+    if filters["phone"]:
+        query = query.filter(Registration.phone == filters["phone"])
+    return query
+
+_LOOKUP = object()
+
+def seek(query, sort, cursor, forward, name=_LOOKUP):
+    # rows strictly after (or before) the cursor row in (name, id) or id order;
+    # for sort=name the cursor row's name is read unless the caller has it
+    if sort == "id":
+        if cursor is not None:
+            query = query.filter(Registration.id > cursor if forward else Registration.id < cursor)
+        order = Registration.id if forward else Registration.id.desc()
+        return query.order_by(order)
+    if cursor is not None and name is _LOOKUP:
+        anchor = db.session.get(Registration, cursor)
+        cursor, name = (cursor, anchor.name) if anchor is not None else (None, None)
+    if cursor is not None:
+        # the first term is the range the index seeks on; the OR only
+        # re-checks rows that share the anchor's name
+        if forward:
+            query = query.filter(NAME_KEY >= name, db.or_(NAME_KEY > name, Registration.id > cursor))
+        else:
+            query = query.filter(NAME_KEY <= name, db.or_(NAME_KEY < name, Registration.id < cursor))
+    if forward:
+        return query.order_by(NAME_KEY, Registration.id)
+    return query.order_by(NAME_KEY.desc(), Registration.id.desc())
+
+@app.route("/list")
+@conditional(lambda: watcher.table_version("registration"))
+def list_users():
+    # keyset pagination on the sort key: every page is one indexed range
+    # scan of at most size+1 rows, however large the table grows
+    size = request.args.get("size", app.config["LIST_PAGE_SIZE"], type=int)
+    size = max(1, min(size, app.config["LIST_MAX_PAGE_SIZE"]))
+    after = request.args.get("after", type=int)
+    before = request.args.get("before", type=int)
+    filters = list_filters()
+    query = filtered_registrations(filters)
+
+    if before is not None:
+        rows = seek(query, filters["sort"], before, forward=False).limit(size + 1).all()
+        has_more = len(rows) > size
+        users = rows[:size][::-1]
+        prev_cursor = users[0].id if has_more else None
+        next_cursor = users[-1].id if users else None
+    else:
+        rows = seek(query, filters["sort"], after, forward=True).limit(size + 1).all()
+        has_more = len(rows) > size
+        users = rows[:size]
+        prev_cursor = users[0].id if after is not None and users else None
+        next_cursor = users[-1].id if has_more else None
+
+    return render_template("list.html", users=users, size=size, filters=filters,
+                           prev_cursor=prev_cursor, next_cursor=next_cursor)
+
+#EXPORT
+EXPORT_COLUMNS = ("id", "name", "email", "phone", "gender")
+
+def export_chunks(filters):
+    # keyset batches with the /list filters, in the /list sort order: each
+    # batch is one short indexed read, the connection goes back to the pool
+    # between batches, and only one batch is ever in memory
+    columns = [getattr(Registration, column) for column in EXPORT_COLUMNS]
+    query = filtered_registrations(filters).with_entities(*columns)
+    last = None
+    while True:
+        if last is None:
+            batch = seek(query, filters["sort"], None, forward=True)
+        else:
+            batch = seek(query, filters["sort"], last[0], forward=True, name=last[1])
+        rows = batch.limit(app.config["EXPORT_CHUNK_SIZE"]).all()
+        db.session.rollback()
+        if not rows:
+            return
+        yield rows
+        last = rows[-1]
+
+def export_response(lines, mimetype, filename):
+    return Response(stream_with_context(lines), mimetype=mimetype,
+                    headers={"Content-Disposition": f"attachment; filename={filename}"})
+
+@app.route("/export.csv")
+def export_csv():
+    filters = list_filters()
+
+    def lines():
+        out = io.StringIO()
+        rows_out = csv.writer(out)
+        # the header goes out before the first query runs
+        rows_out.writerow(EXPORT_COLUMNS)
+        yield out.getvalue()
+        for rows in export_chunks(filters):
+            out.seek(0)
+            out.truncate()
+            rows_out.writerows(rows)
+            yield out.getvalue()
+
+    return export_response(lines(), "text/csv", "registrations.csv")
+
+@app.route("/export.jsonl")
+def export_jsonl():
+    filters = list_filters()
+
+    def lines():
+        for rows in export_chunks(filters):
+            yield "".join(json.dumps(dict(zip(EXPORT_COLUMNS, row))) + "\n" for row in rows)
+
+    return export_response(lines(), "application/x-ndjson", "registrations.jsonl")
+
+#IMPORT
+IMPORT_FIELDS = ("name", "email", "phone", "gender")
+EMAIL_RE = re.compile(r"[^@\s]+@[^@\s]+\.[^@\s]+")
+PHONE_RE = re.compile(r"[0-9+()\-. ]{3,20}")
+GENDERS = {"male": "Male", "female": "Female", "m": "Male", "f": "Female"}
+
+def validate_registration(row):
+    """(name, email, phone, gender) from one CSV row, or ValueError saying what is wrong."""
+    name, email, phone, gender = ((row.get(field) or "").strip() for field in IMPORT_FIELDS)
+    if not name or len(name) > 100:
+        raise ValueError("name is required (at most 100 characters)")
+    if len(email) > 100 or not EMAIL_RE.fullmatch(email):
+        raise ValueError("invalid email")
+    if not PHONE_RE.fullmatch(phone):
+        raise ValueError("invalid phone")
+    if gender.lower() not in GENDERS:
+        raise ValueError("gender must be Male or Female")
+    return name, email, phone, GENDERS[gender.lower()]
+
+def import_registrations(lines, report, batch_size, stats=None):
+    """Insert the valid rows of a CSV stream, batch_size rows per transaction.
+
+    Rejected rows are written to report with their line number and reason.
+    Memory holds one batch; raises ValueError if required columns are missing.
+    stats, if given, is kept up to date with the rows committed and rejected
+    so far, so a caller still has them when a malformed line ends the import
+    after earlier batches went in.
+    """
+    stats = {} if stats is None else stats
+    stats.update(imported=0, rejected=0)
+    reader = csv.DictReader(lines)
+    reader.fieldnames = [field.strip().lower() for field in reader.fieldnames or ()]
+    missing = [field for field in IMPORT_FIELDS if field not in reader.fieldnames]
+    if missing:
+        raise ValueError(f"missing columns: {', '.join(missing)}")
+    rejects = csv.writer(report)
+    rejects.writerow(("line", "error") + IMPORT_FIELDS)
+
+    started = time.monotonic()
+    batch = []
+    con = db.engine.raw_connection()
+    try:
+        def flush():
+            con.cursor().executemany(
+                "INSERT INTO registration (name, email, phone, gender) VALUES (?, ?, ?, ?)", batch)
+            con.commit()
+            stats["imported"] += len(batch)
+            batch.clear()
+
+        for row in reader:
+            try:
+                batch.append(validate_registration(row))
+            except ValueError as e:
+                stats["rejected"] += 1
+                rejects.writerow([reader.line_num, str(e)] + [row.get(field) for field in IMPORT_FIELDS])
+                continue
+            if len(batch) >= batch_size:
+                flush()
+        if batch:
+            flush()
+    finally:
+        con.close()
+    seconds = time.monotonic() - started
+    stats["seconds"] = round(seconds, 3)
+    stats["rows_per_second"] = round((stats["imported"] + stats["rejected"]) / seconds) if seconds else None
+    return stats
+
+@app.route("/import", methods=["POST"])
+def import_upload():
+    upload = request.files.get("file")
+    if upload is None:
+        return jsonify(error="upload a CSV file as 'file'"), 400
+    report_dir = app.config["IMPORT_REPORT_DIR"]
+    os.makedirs(report_dir, exist_ok=True)
+    name = f"{uuid.uuid4().hex}.errors.csv"
+    path = os.path.join(report_dir, name)
+    lines = io.TextIOWrapper(upload.stream, encoding="utf-8-sig", newline="")
+    stats = {}
+    with open(path, "w", newline="") as report:
+        try:
+            summary = import_registrations(lines, report, app.config["IMPORT_BATCH_SIZE"], stats)
+        except (ValueError, UnicodeDecodeError, csv.Error) as e:
+            # batches before the bad line are committed: say how many
+            summary = dict(stats, error=str(e))
+    if summary.get("rejected"):
+        summary["report"] = f"/import/reports/{name}"
+    else:
+        os.remove(path)
+    return jsonify(summary), 400 if "error" in summary else 200
+
+@app.route("/import/reports/<name>")
+def import_report(name):
+    return send_from_directory(app.config["IMPORT_REPORT_DIR"], name, as_attachment=True)
+
+@app.cli.command("import-registrations")
+@click.argument("path", type=click.Path(exists=True, dir_okay=False))
+@click.option("--batch-size", type=int, default=None, help="Rows per transaction.")
+@click.option("--errors", "errors_path", default=None, help="Rejected-row report (default PATH.errors.csv).")
+def import_registrations_command(path, batch_size, errors_path):
+    """Bulk-insert registrations from a CSV with name,email,phone,gender columns."""
+    errors_path = errors_path or path + ".errors.csv"
+    stats = {}
+    with open(path, newline="", encoding="utf-8-sig") as lines, open(errors_path, "w", newline="") as report:
+        try:
+            summary = import_registrations(lines, report, batch_size or app.config["IMPORT_BATCH_SIZE"], stats)
+        except (UnicodeDecodeError, csv.Error) as e:
+            raise click.ClickException(f"{e}; imported {stats['imported']} rows before it, "
+                                       f"rejected {stats['rejected']} (see {errors_path})")
+    click.echo(f"imported {summary['imported']}, rejected {summary['rejected']} "
+               f"in {summary['seconds']}s ({summary['rows_per_second']} rows/s)")
+    if summary["rejected"]:
+        click.echo(f"rejected rows: {errors_path}")
+    else:
+        os.remove(errors_path)
+
+#EDIT USER
+@app.route("/edit/<int:id>", methods=["GET", "POST"])
+def edit_user(id):
+    user = Registration.query.get_or_404(id)
+
+    if request.method == "POST":
+        user.name = request.form["name"]
+        user.email = request.form["email"]
+        user.phone = request.form["phone"]
+        user.gender = request.form["gender"]
+        db.session.commit()
+        return redirect("/list")
+
+    return render_template("edit.html", user=user)
+
+#DELETE
+@app.route("/delete/<int:id>")
+def delete_user(id):
+    user = Registration.query.get_or_404(id)
+    db.session.delete(user)
+    db.session.commit()
+    return redirect("/list")
+
+#GROUP COMMIT STATS
+@app.route("/group-commit")
+def group_commit_stats():
+    return jsonify(writer.stats() if writer is not None else {"enabled": False})
+
+#HTML
+ADD_HTML = """
 <!DOCTYPE html>
 <html>
 <head>
@@ -83,19 +476,21 @@ body {
       </select>
       <button class="btn btn-primary w-100">Save</button>
     </form>
+    <form method="post" action="/import" enctype="multipart/form-data" class="mt-3">
+      <label class="form-label small">Or import a CSV (name, email, phone, gender)</label>
+      <div class="input-group">
+        <input class="form-control" type="file" name="file" accept=".csv" required>
+        <button class="btn btn-outline-primary">Import</button>
+      </div>
+    </form>
   </div>
 </div>
 
 </body>
 </html>
-""")
-
-#LIST USERS
-@app.route("/list")
-def list_users():
-    users = Registration.query.all()
+"""
 
-    return render_template_string("""
+LIST_HTML = """
 <!DOCTYPE html>
 <html>
 <head>
@@ -138,6 +533,32 @@ body {
   <div class="overlay">
     <h4>Registered Users</h4>
 
+    <form class="row g-2 mb-3">
+      <div class="col-md-2">
+        <select class="form-control" name="gender">
+          <option value="">Any gender</option>
+          <option {% if filters.gender=="Male" %}selected{% endif %}>Male</option>
+          <option {% if filters.gender=="Female" %}selected{% endif %}>Female</option>
+        </select>
+      </div>
+      <div class="col-md-3"><input class="form-control" name="name" value="{{ filters.name }}" placeholder="Name starts with"></div>
+      <div class="col-md-2"><input class="form-control" name="domain" value="{{ filters.domain }}" placeholder="Email domain"></div>
+      <div class="col-md-2"><input class="form-control" name="phone" value="{{ filters.phone }}" placeholder="Phone"></div>
+      <div class="col-md-2">
+        <select class="form-control" name="sort">
+          <option value="id">Newest last</option>
+          <option value="name" {% if filters.sort=="name" %}selected{% endif %}>Name A-Z</option>
+        </select>
+      </div>
+      <input type="hidden" name="size" value="{{ size }}">
+      <div class="col-md-1"><button class="btn btn-primary w-100">Filter</button></div>
+    </form>
+    <p class="small">
+      Export these rows:
+      <a href="/export.csv?{{ filters | urlencode }}">CSV</a> &middot;
+      <a href="/export.jsonl?{{ filters | urlencode }}">JSONL</a>
+    </p>
+
     <table class="table table-striped table-hover">
       <thead class="table-primary">
         <tr>
@@ -165,27 +586,23 @@ body {
         {% endfor %}
       </tbody>
     </table>
+
+    <div class="d-flex justify-content-between">
+      {% if prev_cursor %}
+      <a class="btn btn-outline-primary btn-sm" href="/list?{{ dict(filters, before=prev_cursor, size=size) | urlencode }}">&laquo; Prev</a>
+      {% else %}<span></span>{% endif %}
+      {% if next_cursor %}
+      <a class="btn btn-outline-primary btn-sm" href="/list?{{ dict(filters, after=next_cursor, size=size) | urlencode }}">Next &raquo;</a>
+      {% endif %}
+    </div>
   </div>
 </div>
 
 </body>
 </html>
-""", users=users)
+"""
 
-#EDIT USER
-@app.route("/edit/<int:id>", methods=["GET", "POST"])
-def edit_user(id):
-    user = Registration.query.get_or_404(id)
-
-    if request.method == "POST":
-        user.name = request.form["name"]
-        user.email = request.form["email"]
-        user.phone = request.form["phone"]
-        user.gender = request.form["gender"]
-        db.session.commit()
-        return redirect("/list")
-
-    return render_template_string("""
+EDIT_HTML = """
 <!DOCTYPE html>
 <html>
 <head>
@@ -221,15 +638,13 @@ def edit_user(id):
 
 </body>
 </html>
-""", user=user)
+"""
 
-#DELETE
-@app.route("/delete/<int:id>")
-def delete_user(id):
-    user = Registration.query.get_or_404(id)
-    db.session.delete(user)
-    db.session.commit()
-    return redirect("/list")
+template_registry.install(app, {
+    "add.html": ADD_HTML,
+    "list.html": LIST_HTML,
+    "edit.html": EDIT_HTML,
+})
 
 if __name__ == "__main__":
     app.run(host="0.0.0.0", port=10000)
@@ -1,19 +1,98 @@
-from flask import Flask, render_template_string, request, redirect, session
+from flask import Flask, render_template, request, redirect, session, jsonify
+from markupsafe import Markup
 from flask_sqlalchemy import SQLAlchemy # pyright: ignore[reportMissingImports]
+from sqlalchemy.exc import IntegrityError, OperationalError
+from werkzeug.middleware.proxy_fix import ProxyFix
+from datetime import datetime, timedelta
+import csv
+import io
+import os
+import tempfile
+import sqlite_profile
+import template_registry
+from fragment_cache import VersionedCache
+from data_version import DataVersionWatcher
+from conditional import conditional
+from passwords import PasswordHasher, HasherBusy
+from rate_limit import RateLimiter
+from metrics import Metrics
+from sql_hooks import QueryHooks
+from sql_trace import QueryTracer
+from server_timing import ServerTiming
+import book_search
+import book_import
+import click
+from catalog_index import install_changelog, TrigramIndex, PrefixIndex
 
 app = Flask(__name__)
 app.secret_key = "library_secret"
 
-app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite:///library.db"
+app.config["SQLALCHEMY_DATABASE_URI"] = os.environ.get("LIBRARY_DATABASE_URI", "sqlite:///library.db")
 app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+app.config["SQLITE_PROFILE"] = os.environ.get("SQLITE_PROFILE", "throughput")
+app.config["JINJA_BYTECODE_CACHE"] = os.environ.get("JINJA_BYTECODE_CACHE")
+app.config["LOAN_DAYS"] = int(os.environ.get("LOAN_DAYS", 14))
+app.config["LOANS_PAGE_SIZE"] = int(os.environ.get("LOANS_PAGE_SIZE", 25))
+app.config["SEARCH_PAGE_SIZE"] = int(os.environ.get("SEARCH_PAGE_SIZE", 24))
+# scrypt N = 2**PASSWORD_HASH_COST, hashed in PASSWORD_HASH_WORKERS processes per worker
+app.config["PASSWORD_HASH_COST"] = int(os.environ.get("PASSWORD_HASH_COST", 15))
+app.config["PASSWORD_HASH_WORKERS"] = int(os.environ.get("PASSWORD_HASH_WORKERS", 2))
+# login/registration throttling; buckets shared by all workers through RATE_LIMIT_DB
+app.config["RATE_LIMIT"] = os.environ.get("RATE_LIMIT", "1") == "1"
+app.config["RATE_LIMIT_DB"] = os.environ.get(
+    "RATE_LIMIT_DB", os.path.join(tempfile.gettempdir(), "app123-ratelimit.db"))
+app.config["RATE_LIMIT_IP"] = os.environ.get("RATE_LIMIT_IP", "20/60")
+app.config["RATE_LIMIT_ACCOUNT"] = os.environ.get("RATE_LIMIT_ACCOUNT", "5/60")
+# reverse proxies in front of the app that append to X-Forwarded-For; the limiter
+# keys on the client address they report (0 = clients connect directly)
+app.config["TRUSTED_PROXIES"] = int(os.environ.get("TRUSTED_PROXIES", 0))
+# /metrics; every worker of one gunicorn master must share METRICS_DIR ("" = per process)
+app.config["METRICS_DIR"] = os.environ.get(
+    "METRICS_DIR", os.path.join(tempfile.gettempdir(), "app123-metrics"))
+# SQL log: statements slower than SQL_SLOW_MS, and templates run more than SQL_REPEAT_LIMIT times per request
+app.config["SQL_SLOW_MS"] = float(os.environ.get("SQL_SLOW_MS", 100))
+app.config["SQL_REPEAT_LIMIT"] = int(os.environ.get("SQL_REPEAT_LIMIT", 10))
+# Server-Timing header (db, render, session, total); off by default, it exposes timings to clients
+app.config["SERVER_TIMING"] = os.environ.get("SERVER_TIMING", "0") == "1"
 
 db = SQLAlchemy(app)
 
+hasher = PasswordHasher(app.config["PASSWORD_HASH_COST"], app.config["PASSWORD_HASH_WORKERS"])
+limiter = RateLimiter(app.config["RATE_LIMIT_DB"], app.config["RATE_LIMIT_IP"],
+                      app.config["RATE_LIMIT_ACCOUNT"])
+if app.config["TRUSTED_PROXIES"]:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=app.config["TRUSTED_PROXIES"])
+if app.config["RATE_LIMIT"]:
+    limiter.init_app(app)
+# after the limiter, so its hook goes in ahead of it and 429s are counted
+metrics = Metrics("app123", app.config["METRICS_DIR"])
+metrics.init_app(app)
+query_hooks = QueryHooks()
+query_tracer = QueryTracer(app.config["SQL_SLOW_MS"], app.config["SQL_REPEAT_LIMIT"])
+query_tracer.init_app(app)
+query_hooks.subscribe(metrics.record_query)
+query_hooks.subscribe(query_tracer.record_query)
+server_timing = ServerTiming()
+if app.config["SERVER_TIMING"]:
+    server_timing.init_app(app, query_hooks)
+
+# rendered catalog per role; every write to Book bumps its version
+catalog_cache = VersionedCache()
+
+with app.app_context():
+    # before install(), whose check opens the first connection
+    query_hooks.instrument_engine(db.engine)
+    sqlite_profile.install(db.engine, app.config["SQLITE_PROFILE"])
+    # drop per-process caches whenever any worker commits to library.db
+    watcher = DataVersionWatcher(db.engine.url.database)
+    watcher.subscribe(catalog_cache.bump)
+    watcher.init_app(app)
+
 # ------------------ MODELS ------------------
 class User(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(50), unique=True)
-    password = db.Column(db.String(50))
+    password = db.Column(db.String(200))  # werkzeug hash; plaintext until first login
     role = db.Column(db.String(10))
 
 class Book(db.Model):
@@ -21,102 +100,503 @@ class Book(db.Model):
     title = db.Column(db.String(100))
     author = db.Column(db.String(100))
     image = db.Column(db.String(300))
-    available = db.Column(db.Boolean, default=True)
+    # one row per title; available mirrors available_copies > 0
+    total_copies = db.Column(db.Integer, nullable=False, default=1, server_default="1")
+    available_copies = db.Column(db.Integer, nullable=False, default=1, server_default="1")
+    available = db.Column(db.Boolean, default=True, index=True)
+    # hash of the normalized title/author; book_import dedupes on it
+    catalog_key = db.Column(db.Integer)
+
+class Loan(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    book_id = db.Column(db.Integer, db.ForeignKey("book.id"), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey("user.id"), nullable=False)
+    issued_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    due_at = db.Column(db.DateTime, nullable=False)
+    returned_at = db.Column(db.DateTime)
+
+    __table_args__ = (
+        # history per user / per book, newest first, paged on id
+        db.Index("ix_loan_user_history", "user_id", "id"),
+        db.Index("ix_loan_book_history", "book_id", "id"),
+        # open loans only: "what does this student hold" / "who holds this book"
+        db.Index("ix_loan_user_current", "user_id", sqlite_where=db.text("returned_at IS NULL")),
+        db.Index("ix_loan_book_current", "book_id", sqlite_where=db.text("returned_at IS NULL")),
+    )
+
+class Hold(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    book_id = db.Column(db.Integer, db.ForeignKey("book.id"), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey("user.id"), nullable=False)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    status = db.Column(db.String(10), nullable=False, default="waiting")  # waiting/fulfilled/cancelled
+    closed_at = db.Column(db.DateTime)
+
+    __table_args__ = (
+        # FIFO queue per book: the head is the lowest waiting id
+        db.Index("ix_hold_queue", "book_id", "id", sqlite_where=db.text("status = 'waiting'")),
+        # one place in a queue per student
+        db.Index("ux_hold_waiting", "book_id", "user_id", unique=True,
+                 sqlite_where=db.text("status = 'waiting'")),
+        db.Index("ix_hold_user", "user_id", "id"),
+    )
 
 # ------------------ INIT DB ------------------
 def setup_db():
-    with app.app_context():
+    with app.app_context(), sqlite_profile.schema_setup(db.engine):
         db.create_all()
+        watcher.track("book")
+        # create_all() skips indexes on tables that already exist
+        for model in (User, Book, Loan, Hold):
+            for index in model.__table__.indexes:
+                index.create(db.engine, checkfirst=True)
+        add_copy_columns()
+        with_raw_connection(lambda con: book_search.install(con, "book"))
+        with_raw_connection(lambda con: install_changelog(con, "book"))
+        with_raw_connection(lambda con: book_import.install(con, "book"))
         if not User.query.filter_by(username="admin").first():
-            db.session.add(User(username="admin", password="admin123", role="admin"))
+            db.session.add(User(username="admin", password=hasher.hash("admin123"), role="admin"))
             db.session.commit()
 
+def with_raw_connection(fn):
+    con = db.engine.raw_connection()
+    try:
+        fn(con)
+        con.commit()
+    finally:
+        con.close()
+
+def driver_rows(sql, params):
+    return db.session.connection().exec_driver_sql(sql, tuple(params)).fetchall()
+
+# per-worker trigram index for typo-tolerant search; follows book_changes
+fuzzy_index = TrigramIndex("book", driver_rows)
+# sorted titles/authors for /api/books/suggest, kept in step the same way
+suggest_index = PrefixIndex("book", driver_rows)
+
+@app.cli.command("rebuild-search")
+def rebuild_search():
+    """Re-index every book for /search."""
+    with app.app_context():
+        with_raw_connection(lambda con: book_search.rebuild(con, "book"))
+
+@app.cli.command("import-books")
+@click.argument("path", type=click.Path(exists=True, dir_okay=False))
+@click.option("--format", "format", type=click.Choice(["csv", "jsonl"]), default=None,
+              help="Defaults to the file extension.")
+@click.option("--batch-size", type=int, default=5000, help="Books per transaction.")
+def import_books(path, format, batch_size):
+    """Bulk-load books from CSV/JSONL with title, author and optional copies, image."""
+    def progress(stats):
+        click.echo(f"{stats['lines']} lines: {stats['inserted']} new, "
+                   f"{stats['duplicates']} duplicates, {stats['rejected']} rejected")
+    with app.app_context(), open(path, newline="", encoding="utf-8-sig") as lines:
+        records = book_import.read_records(lines, format or book_import.format_for(path))
+        with_raw_connection(lambda con: book_import.load(con, "book", records, batch_size, progress))
+
+def add_copy_columns():
+    # databases created before multi-copy inventory: every row is one copy
+    columns = {row[1] for row in db.session.execute(db.text("PRAGMA table_info(book)"))}
+    if "total_copies" not in columns:
+        db.session.execute(db.text(
+            "ALTER TABLE book ADD COLUMN total_copies INTEGER NOT NULL DEFAULT 1"))
+    if "available_copies" not in columns:
+        db.session.execute(db.text(
+            "ALTER TABLE book ADD COLUMN available_copies INTEGER NOT NULL DEFAULT 1"))
+        db.session.execute(db.text("UPDATE book SET available_copies = 0 WHERE NOT available"))
+    db.session.commit()
+
 # ------------------ AUTH ------------------
 @app.route("/", methods=["GET", "POST"])
+@limiter.limit(account=lambda: request.form.get("username"))
 def login():
     if request.method == "POST":
         user = User.query.filter_by(
             username=request.form["username"],
-            password=request.form["password"],
             role=request.form["role"]
         ).first()
-        if user:
+        password = request.form["password"]
+        try:
+            ok, rehash = hasher.verify(user.password if user else None, password)
+            if ok and rehash and not sqlite_profile.read_only(app.config["SQLITE_PROFILE"]):
+                # legacy plaintext or an old cost: upgrade while we know the password;
+                # if the write fails the login still counts, the next one retries
+                try:
+                    db.session.execute(
+                        db.update(User)
+                        .where(User.id == user.id, User.password == user.password)
+                        .values(password=hasher.hash(password)))
+                    db.session.commit()
+                except OperationalError:
+                    db.session.rollback()
+                    app.logger.warning("could not upgrade the password hash of user %s", user.id, exc_info=True)
+        except HasherBusy:
+            return "Too many logins right now, please try again.", 503
+        if ok:
             session["user"] = user.username
+            session["user_id"] = user.id
             session["role"] = user.role
             return redirect("/dashboard")
-    return render_template_string(LOGIN_HTML)
+    return render_template("login.html")
 
 @app.route("/register", methods=["GET", "POST"])
+@limiter.limit(account=lambda: request.form.get("username"))
 def register():
     if request.method == "POST":
+        try:
+            password = hasher.hash(request.form["password"])
+        except HasherBusy:
+            return "Too many sign-ups right now, please try again.", 503
         db.session.add(User(
             username=request.form["username"],
-            password=request.form["password"],
+            password=password,
             role="student"
         ))
         db.session.commit()
         return redirect("/")
-    return render_template_string(REGISTER_HTML)
+    return render_template("register.html")
 
 @app.route("/logout")
 def logout():
     session.clear()
     return redirect("/")
 
+def current_user_id():
+    # sessions from before loans were tracked only carry the username
+    if "user_id" not in session:
+        session["user_id"] = User.query.filter_by(username=session["user"]).first().id
+    return session["user_id"]
+
 # ------------------ DASHBOARD ------------------
+def dashboard_key():
+    version = watcher.table_version("book")
+    if "user" not in session or version is None:
+        return None
+    return version, session["role"]
+
+CATALOG_COLUMNS = (Book.id, Book.title, Book.author, Book.image, Book.available_copies, Book.total_copies)
+
 @app.route("/dashboard")
+@conditional(dashboard_key)
 def dashboard():
     if "user" not in session:
         return redirect("/")
-    books = Book.query.all()
-    return render_template_string(DASHBOARD_HTML, books=books, role=session["role"])
+    role = session["role"]
+    # plain rows: the template only reads columns, and building 100k+ ORM
+    # objects took longer than the query and the render together
+    catalog = catalog_cache.get(role, lambda: render_template(
+        "catalog.html", books=db.session.execute(db.select(*CATALOG_COLUMNS)).all(), role=role))
+    return render_template("dashboard.html", catalog=Markup(catalog), role=role)
+
+@app.route("/search")
+@conditional(dashboard_key)
+def search():
+    if "user" not in session:
+        return redirect("/")
+    q = request.args.get("q", "").strip()
+    page = max(1, request.args.get("page", 1, type=int))
+    size = app.config["SEARCH_PAGE_SIZE"]
+    query = book_search.search_query("book", q, size + 1, (page - 1) * size)
+    hits = driver_rows(*query) if query else []
+    ids = [hit[0] for hit in hits[:size]]
+    # nothing spelled that way: fall back to the closest titles/authors
+    fuzzy = page == 1 and not ids and bool(q)
+    if fuzzy:
+        fuzzy_index.refresh(watcher.generation)
+        ids = [id for _, id in fuzzy_index.query(q, size)]
+    books = {book.id: book for book in Book.query.filter(Book.id.in_(ids))} if ids else {}
+    return render_template("search.html", q=q, page=page, fuzzy=fuzzy, has_next=len(hits) > size,
+                           books=[books[id] for id in ids if id in books],
+                           role=session["role"])
+
+@app.route("/api/books/suggest")
+def suggest():
+    if "user" not in session:
+        return jsonify(error="login required"), 401
+    # reads SQLite only when some worker has committed since the last keystroke
+    suggest_index.refresh(watcher.generation)
+    prefix = request.args.get("prefix", "")
+    return jsonify([{"kind": kind, "text": text} for kind, text in suggest_index.suggest(prefix)])
+
+@app.route("/admin/cache")
+def cache_stats():
+    if session.get("role") != "admin":
+        return redirect("/")
+    return jsonify(catalog_cache.stats())
 
 # ------------------ ADMIN CRUD ------------------
+def form_copies():
+    return max(1, request.form.get("copies", 1, type=int))
+
 @app.route("/add", methods=["POST"])
 def add_book():
     if session.get("role") == "admin":
+        copies = form_copies()
         db.session.add(Book(
             title=request.form["title"],
             author=request.form["author"],
-            image=request.form["image"]
+            image=request.form["image"],
+            total_copies=copies,
+            available_copies=copies,
+            catalog_key=book_import.catalog_key(request.form["title"], request.form["author"])
         ))
         db.session.commit()
+        catalog_cache.bump()
     return redirect("/dashboard")
 
 @app.route("/edit/<int:id>", methods=["POST"])
 def edit_book(id):
     if session.get("role") == "admin":
-        book = Book.query.get(id)
-        book.title = request.form["title"]
-        book.author = request.form["author"]
-        book.image = request.form["image"]
+        copies = form_copies()
+        # changing the stock shifts the free copies by the same amount, but
+        # never below the number currently on loan
+        available = Book.available_copies + copies - Book.total_copies
+        result = db.session.execute(
+            db.update(Book)
+            .where(Book.id == id, Book.total_copies - Book.available_copies <= copies)
+            .values(title=request.form["title"],
+                    author=request.form["author"],
+                    image=request.form["image"],
+                    catalog_key=book_import.catalog_key(request.form["title"], request.form["author"]),
+                    total_copies=copies,
+                    available_copies=available,
+                    available=available > 0)
+        )
+        if result.rowcount != 1:
+            db.session.rollback()
+            if db.session.get(Book, id) is None:
+                return "No such book. <a href='/dashboard'>Back</a>", 404
+            return "More copies are on loan than that. <a href='/dashboard'>Back</a>", 409
+        # copies added to a title with a queue go to the queue
+        drain_holds(id)
         db.session.commit()
+        catalog_cache.bump()
     return redirect("/dashboard")
 
+@app.route("/admin/import", methods=["POST"])
+def import_upload():
+    if session.get("role") != "admin":
+        return redirect("/")
+    upload = request.files.get("file")
+    if upload is None:
+        return jsonify(error="upload a CSV or JSONL file as 'file'"), 400
+    lines = io.TextIOWrapper(upload.stream, encoding="utf-8-sig", newline="")
+    records = book_import.read_records(lines, book_import.format_for(upload.filename or ""))
+    stats = {}
+
+    def progress(committed):
+        # kept so a failure partway can say what the earlier batches added
+        stats.update(committed)
+        app.logger.info("book import %s: %s", upload.filename, committed)
+
+    try:
+        with_raw_connection(lambda con: stats.update(book_import.load(con, "book", records, progress=progress)))
+    except (UnicodeDecodeError, csv.Error) as e:
+        catalog_cache.bump()
+        return jsonify(error=str(e), **stats), 400
+    catalog_cache.bump()
+    return jsonify(stats)
+
 @app.route("/delete/<int:id>")
 def delete_book(id):
     if session.get("role") == "admin":
-        Book.query.filter_by(id=id).delete()
+        # only while every copy is on the shelf, so no loan is left open on a
+        # book that is gone; its queue is closed in the same transaction
+        result = db.session.execute(
+            db.delete(Book).where(Book.id == id, Book.available_copies == Book.total_copies))
+        if result.rowcount != 1:
+            db.session.rollback()
+            if db.session.get(Book, id) is None:
+                return "No such book. <a href='/dashboard'>Back</a>", 404
+            return "Copies of this book are on loan. <a href='/dashboard'>Back</a>", 409
+        db.session.execute(
+            db.update(Hold)
+            .where(Hold.book_id == id, Hold.status == "waiting")
+            .values(status="cancelled", closed_at=datetime.utcnow()))
         db.session.commit()
+        catalog_cache.bump()
     return redirect("/dashboard")
 
 # ------------------ STUDENT ACTIONS ------------------
+def take_copy(id):
+    # guarded decrement in one statement: when students race for the last
+    # copy exactly one UPDATE matches, the others see rowcount 0
+    result = db.session.execute(
+        db.update(Book)
+        .where(Book.id == id, Book.available_copies > 0)
+        .values(available_copies=Book.available_copies - 1,
+                available=Book.available_copies > 1)
+    )
+    return result.rowcount == 1
+
+def put_back_copy(id):
+    result = db.session.execute(
+        db.update(Book)
+        .where(Book.id == id, Book.available_copies < Book.total_copies)
+        .values(available_copies=Book.available_copies + 1, available=True)
+    )
+    return result.rowcount == 1
+
+def open_loan(book_id, user_id):
+    now = datetime.utcnow()
+    db.session.add(Loan(book_id=book_id, user_id=user_id, issued_at=now,
+                        due_at=now + timedelta(days=app.config["LOAN_DAYS"])))
+
+def issue_book(book_id, user_id):
+    if not take_copy(book_id):
+        db.session.rollback()
+        return False
+    open_loan(book_id, user_id)
+    db.session.commit()
+    return True
+
+def next_hold(book_id):
+    # head of the queue via ix_hold_queue; called after the transaction's first
+    # write, so no other worker can dequeue the same hold concurrently
+    return (Hold.query
+            .filter(Hold.book_id == book_id, Hold.status == "waiting")
+            .order_by(Hold.id)
+            .first())
+
+def fulfil(hold):
+    hold.status = "fulfilled"
+    hold.closed_at = datetime.utcnow()
+    open_loan(hold.book_id, hold.user_id)
+
+def drain_holds(book_id):
+    # free copies go to the queue first, so nobody can issue them ahead of it;
+    # call after the transaction's first write, like next_hold()
+    while True:
+        hold = next_hold(book_id)
+        if hold is None or not take_copy(book_id):
+            return
+        fulfil(hold)
+
+def return_loan(book_id, user_id):
+    # one returned copy closes one loan: a student may hold several copies
+    # of a title, so close only the oldest of their open loans on it
+    oldest = (db.select(Loan.id)
+              .where(Loan.book_id == book_id, Loan.user_id == user_id, Loan.returned_at.is_(None))
+              .order_by(Loan.id)
+              .limit(1)
+              .scalar_subquery())
+    closed = db.session.execute(
+        db.update(Loan)
+        .where(Loan.id == oldest, Loan.returned_at.is_(None))
+        .values(returned_at=datetime.utcnow())
+    )
+    # copies issued before loans were recorded have no open loan at all
+    if closed.rowcount == 0:
+        book = db.session.get(Book, book_id)
+        open_loans = Loan.query.filter_by(book_id=book_id, returned_at=None).count()
+        if book is None or open_loans >= book.total_copies - book.available_copies:
+            db.session.rollback()
+            return False
+    # the returned copy goes straight to the next student in line, if any
+    hold = next_hold(book_id)
+    if hold is not None:
+        fulfil(hold)
+    elif not put_back_copy(book_id):
+        db.session.rollback()
+        return False
+    db.session.commit()
+    return True
+
 @app.route("/issue/<int:id>")
 def issue(id):
     if session.get("role") == "student":
-        book = Book.query.get(id)
-        book.available = False
-        db.session.commit()
+        if not issue_book(id, current_user_id()):
+            return "This book is not available any more. <a href='/dashboard'>Back</a>", 409
+        catalog_cache.bump()
     return redirect("/dashboard")
 
 @app.route("/return/<int:id>")
 def return_book(id):
     if session.get("role") == "student":
-        book = Book.query.get(id)
-        book.available = True
-        db.session.commit()
+        if not return_loan(id, current_user_id()):
+            return "You do not have this book. <a href='/dashboard'>Back</a>", 409
+        catalog_cache.bump()
     return redirect("/dashboard")
 
+@app.route("/hold/<int:id>")
+def place_hold(id):
+    if session.get("role") == "student":
+        book = db.session.get(Book, id)
+        if book is None:
+            return "No such book. <a href='/dashboard'>Back</a>", 404
+        if book.available_copies > 0:
+            return "This book can be issued right away. <a href='/dashboard'>Back</a>", 409
+        db.session.add(Hold(book_id=id, user_id=current_user_id()))
+        try:
+            db.session.flush()
+        except IntegrityError:
+            db.session.rollback()
+            return "You are already waiting for this book. <a href='/holds'>Back</a>", 409
+        # a copy may have come back since the check above
+        drain_holds(id)
+        db.session.commit()
+    return redirect("/holds")
+
+@app.route("/hold/<int:id>/cancel")
+def cancel_hold(id):
+    if session.get("role") == "student":
+        db.session.execute(
+            db.update(Hold)
+            .where(Hold.id == id, Hold.user_id == current_user_id(), Hold.status == "waiting")
+            .values(status="cancelled", closed_at=datetime.utcnow())
+        )
+        db.session.commit()
+    return redirect("/holds")
+
+@app.route("/holds")
+def holds():
+    if session.get("role") != "student":
+        return redirect("/dashboard")
+    rows = (db.session.query(Hold, Book.title)
+            .outerjoin(Book, Book.id == Hold.book_id)
+            .filter(Hold.user_id == current_user_id())
+            .order_by(Hold.id.desc())
+            .limit(app.config["LOANS_PAGE_SIZE"])
+            .all())
+    # place in line = waiting holds ahead of ours, counted on ix_hold_queue
+    # for all of the page's waiting holds in one grouped query
+    waiting = [hold.id for hold, title in rows if hold.status == "waiting"]
+    ahead = db.aliased(Hold)
+    positions = dict(
+        db.session.query(Hold.id, db.func.count(ahead.id) + 1)
+        .outerjoin(ahead, db.and_(ahead.book_id == Hold.book_id, ahead.status == "waiting",
+                                  ahead.id < Hold.id))
+        .filter(Hold.id.in_(waiting))
+        .group_by(Hold.id)
+        .all()
+    ) if waiting else {}
+    return render_template("holds.html", rows=rows, positions=positions)
+
+@app.route("/loans")
+def loans():
+    if "user" not in session:
+        return redirect("/")
+    query = db.session.query(Loan, Book.title).outerjoin(Book, Book.id == Loan.book_id)
+    book_id = request.args.get("book", type=int)
+    user_id = request.args.get("user", type=int)
+    if session["role"] == "admin" and book_id is not None:
+        query = query.filter(Loan.book_id == book_id)
+    elif session["role"] == "admin" and user_id is not None:
+        query = query.filter(Loan.user_id == user_id)
+    elif session["role"] != "admin":
+        query = query.filter(Loan.user_id == current_user_id())
+
+    # keyset pagination, newest first
+    size = app.config["LOANS_PAGE_SIZE"]
+    before = request.args.get("before", type=int)
+    if before is not None:
+        query = query.filter(Loan.id < before)
+    rows = query.order_by(Loan.id.desc()).limit(size + 1).all()
+    next_cursor = rows[size - 1][0].id if len(rows) > size else None
+    args = {k: v for k, v in request.args.items() if k != "before"}
+    return render_template("loans.html", rows=rows[:size], next_cursor=next_cursor,
+                           args=args, now=datetime.utcnow())
+
 # ------------------ HTML + CSS ------------------
 LOGIN_HTML = """
 <!DOCTYPE html>
@@ -194,7 +674,15 @@ object-fit:cover;
 
 <nav class="navbar navbar-dark bg-dark px-3">
 <span class="navbar-brand">📖 Library Management</span>
+<form action="/search" class="d-flex ms-auto me-2">
+<input class="form-control" name="q" placeholder="Search title or author" list="suggestions" autocomplete="off" id="q">
+<datalist id="suggestions"></datalist>
+</form>
+<div>
+<a href="/loans" class="btn btn-outline-light">Loans</a>
+{% if role!="admin" %}<a href="/holds" class="btn btn-outline-light">Holds</a>{% endif %}
 <a href="/logout" class="btn btn-danger">Logout</a>
+</div>
 </nav>
 
 <div class="container mt-4">
@@ -204,14 +692,37 @@ object-fit:cover;
 <h5>Add New Book</h5>
 <form method="post" action="/add" class="row g-2">
 <div class="col-md-4"><input class="form-control" name="title" placeholder="Title" required></div>
-<div class="col-md-4"><input class="form-control" name="author" placeholder="Author" required></div>
-<div class="col-md-4"><input class="form-control" name="image" placeholder="Image URL"></div>
+<div class="col-md-3"><input class="form-control" name="author" placeholder="Author" required></div>
+<div class="col-md-3"><input class="form-control" name="image" placeholder="Image URL"></div>
+<div class="col-md-2"><input class="form-control" type="number" min="1" name="copies" value="1" title="Copies"></div>
 <button class="btn btn-primary">Add Book</button>
 </form>
+<form method="post" action="/admin/import" enctype="multipart/form-data" class="input-group mt-2">
+<input class="form-control" type="file" name="file" accept=".csv,.jsonl,.ndjson" required>
+<button class="btn btn-outline-primary">Import CSV/JSONL</button>
+</form>
 </div>
 {% endif %}
 
 <div class="row g-4">
+{{ catalog }}
+</div>
+</div>
+<script>
+const q = document.getElementById("q");
+const suggestions = document.getElementById("suggestions");
+q.addEventListener("input", async () => {
+    const r = await fetch("/api/books/suggest?prefix=" + encodeURIComponent(q.value));
+    if (!r.ok) return;
+    suggestions.replaceChildren(...(await r.json()).map(s => new Option(s.kind, s.text)));
+});
+</script>
+</body>
+</html>
+"""
+
+# book cards, rendered once per role and catalog version
+CATALOG_HTML = """
 {% for book in books %}
 <div class="col-md-4 col-sm-6">
 <div class="card shadow h-100">
@@ -219,19 +730,24 @@ object-fit:cover;
 <div class="card-body">
 <h5>{{book.title}}</h5>
 <p class="text-muted">{{book.author}}</p>
+<p class="small">{{book.available_copies}} of {{book.total_copies}} available</p>
 
 {% if role=="admin" %}
 <form method="post" action="/edit/{{book.id}}">
 <input class="form-control mb-1" name="title" value="{{book.title}}">
 <input class="form-control mb-1" name="author" value="{{book.author}}">
-<input class="form-control mb-2" name="image" value="{{book.image}}">
+<input class="form-control mb-1" name="image" value="{{book.image}}">
+<input class="form-control mb-2" type="number" min="1" name="copies" value="{{book.total_copies}}" title="Copies">
 <button class="btn btn-warning btn-sm">Update</button>
 <a href="/delete/{{book.id}}" class="btn btn-danger btn-sm">Delete</a>
 </form>
 {% else %}
-{% if book.available %}
-<a href="/issue/{{book.id}}" class="btn btn-success w-100">Issue</a>
+{% if book.available_copies > 0 %}
+<a href="/issue/{{book.id}}" class="btn btn-success w-100 mb-1">Issue</a>
 {% else %}
+<a href="/hold/{{book.id}}" class="btn btn-outline-primary w-100 mb-1">Place Hold</a>
+{% endif %}
+{% if book.available_copies < book.total_copies %}
 <a href="/return/{{book.id}}" class="btn btn-secondary w-100">Return</a>
 {% endif %}
 {% endif %}
@@ -240,12 +756,155 @@ object-fit:cover;
 </div>
 </div>
 {% endfor %}
+"""
+
+LOANS_HTML = """
+<!DOCTYPE html>
+<html>
+<head>
+<title>Loans</title>
+<link href="https://cdn.jsdelivr.net/npm/bootstrap@5.3.2/dist/css/bootstrap.min.css" rel="stylesheet">
+</head>
+<body>
+
+<nav class="navbar navbar-dark bg-dark px-3">
+<span class="navbar-brand">📖 Library Management</span>
+<div>
+<a href="/dashboard" class="btn btn-outline-light">Books</a>
+<a href="/logout" class="btn btn-danger">Logout</a>
+</div>
+</nav>
+
+<div class="container mt-4">
+<div class="card p-3 shadow">
+<h5>Loan History</h5>
+<table class="table table-striped">
+<thead>
+<tr><th>Book</th><th>Issued</th><th>Due</th><th>Returned</th></tr>
+</thead>
+<tbody>
+{% for loan, title in rows %}
+<tr>
+<td>{{ title or "(deleted book)" }}</td>
+<td>{{ loan.issued_at.strftime("%Y-%m-%d") }}</td>
+<td {% if not loan.returned_at and loan.due_at < now %}class="text-danger"{% endif %}>{{ loan.due_at.strftime("%Y-%m-%d") }}</td>
+<td>{{ loan.returned_at.strftime("%Y-%m-%d") if loan.returned_at else "on loan" }}</td>
+</tr>
+{% endfor %}
+</tbody>
+</table>
+{% if next_cursor %}
+<a class="btn btn-outline-primary btn-sm" href="/loans?{{ args | urlencode }}{{ '&' if args }}before={{ next_cursor }}">Older &raquo;</a>
+{% endif %}
 </div>
 </div>
 </body>
 </html>
 """
 
+HOLDS_HTML = """
+<!DOCTYPE html>
+<html>
+<head>
+<title>Holds</title>
+<link href="https://cdn.jsdelivr.net/npm/bootstrap@5.3.2/dist/css/bootstrap.min.css" rel="stylesheet">
+</head>
+<body>
+
+<nav class="navbar navbar-dark bg-dark px-3">
+<span class="navbar-brand">📖 Library Management</span>
+<div>
+<a href="/dashboard" class="btn btn-outline-light">Books</a>
+<a href="/loans" class="btn btn-outline-light">Loans</a>
+<a href="/logout" class="btn btn-danger">Logout</a>
+</div>
+</nav>
+
+<div class="container mt-4">
+<div class="card p-3 shadow">
+<h5>My Holds</h5>
+<table class="table table-striped">
+<thead>
+<tr><th>Book</th><th>Placed</th><th>Status</th><th></th></tr>
+</thead>
+<tbody>
+{% for hold, title in rows %}
+<tr>
+<td>{{ title or "(deleted book)" }}</td>
+<td>{{ hold.created_at.strftime("%Y-%m-%d") }}</td>
+{% if hold.status == "waiting" %}
+<td>#{{ positions[hold.id] }} in line</td>
+<td><a href="/hold/{{ hold.id }}/cancel" class="btn btn-outline-danger btn-sm">Cancel</a></td>
+{% else %}
+<td>{{ hold.status }}</td>
+<td></td>
+{% endif %}
+</tr>
+{% endfor %}
+</tbody>
+</table>
+</div>
+</div>
+</body>
+</html>
+"""
+
+SEARCH_HTML = """
+<!DOCTYPE html>
+<html>
+<head>
+<title>Search</title>
+<link href="https://cdn.jsdelivr.net/npm/bootstrap@5.3.2/dist/css/bootstrap.min.css" rel="stylesheet">
+<style>
+img{
+height:220px;
+object-fit:cover;
+}
+</style>
+</head>
+<body>
+
+<nav class="navbar navbar-dark bg-dark px-3">
+<span class="navbar-brand">📖 Library Management</span>
+<form action="/search" class="d-flex ms-auto me-2">
+<input class="form-control" name="q" value="{{ q }}" placeholder="Search title or author">
+</form>
+<div>
+<a href="/dashboard" class="btn btn-outline-light">Books</a>
+<a href="/logout" class="btn btn-danger">Logout</a>
+</div>
+</nav>
+
+<div class="container mt-4">
+<h5>Results for "{{ q }}"</h5>
+{% if fuzzy and books %}<p class="text-muted">No exact matches &mdash; showing the closest titles and authors.</p>{% endif %}
+<div class="row g-4">
+{% include "catalog.html" %}
+</div>
+{% if not books %}<p class="text-muted mt-3">No books found.</p>{% endif %}
+<div class="d-flex justify-content-between my-4">
+{% if page > 1 %}
+<a class="btn btn-outline-primary btn-sm" href="/search?{{ {'q': q, 'page': page - 1} | urlencode }}">&laquo; Prev</a>
+{% else %}<span></span>{% endif %}
+{% if has_next %}
+<a class="btn btn-outline-primary btn-sm" href="/search?{{ {'q': q, 'page': page + 1} | urlencode }}">Next &raquo;</a>
+{% endif %}
+</div>
+</div>
+</body>
+</html>
+"""
+
+template_registry.install(app, {
+    "login.html": LOGIN_HTML,
+    "register.html": REGISTER_HTML,
+    "dashboard.html": DASHBOARD_HTML,
+    "catalog.html": CATALOG_HTML,
+    "loans.html": LOANS_HTML,
+    "holds.html": HOLDS_HTML,
+    "search.html": SEARCH_HTML,
+})
+
 # ------------------ RUN ------------------
 if __name__ == "__main__":
     setup_db()
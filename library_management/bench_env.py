@@ -0,0 +1,42 @@
+"""Scratch environment for the benchmark, stress and audit scripts in this directory.
+
+    workdir = bench_env.setup("list_bench", PASSWORD_HASH_COST=10)
+
+The scripts import the apps, which read their settings from the
+environment at import time, so setup() has to run first. It makes a
+temporary directory, points every file the three apps write into it
+(registrations.db, app123.db, library.db, ratelimit.db and
+import_reports/), turns rate limiting off and sets METRICS_DIR to "", so
+no script writes into the host-wide metrics directories that a live
+/metrics page reads. Keyword arguments are extra settings on top. It then
+puts this directory on sys.path, warns on stderr if check_copies finds a
+root copy that has drifted from its source here, and changes into the
+scratch directory.
+"""
+import os
+import sys
+import tempfile
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def setup(name, **settings):
+    """Isolate the apps' settings in a new scratch directory and return its path."""
+    workdir = tempfile.mkdtemp(prefix=f"{name}_")
+    os.environ.update({
+        "REGISTRATIONS_DB": os.path.join(workdir, "registrations.db"),
+        "LIBRARY_DATABASE_URI": "sqlite:///" + os.path.join(workdir, "app123.db"),
+        "LIBRARY_DB": os.path.join(workdir, "library.db"),
+        "RATE_LIMIT_DB": os.path.join(workdir, "ratelimit.db"),
+        "IMPORT_REPORT_DIR": os.path.join(workdir, "import_reports"),
+        "METRICS_DIR": "",
+        "RATE_LIMIT": "0",
+    })
+    os.environ.update({key: str(value) for key, value in settings.items()})
+    if HERE not in sys.path:
+        sys.path.insert(0, HERE)
+    import check_copies
+    for line in check_copies.problems():
+        print(f"warning: {line} (python check_copies.py)", file=sys.stderr)
+    os.chdir(workdir)
+    return workdir
@@ -0,0 +1,139 @@
+import csv
+import hashlib
+import json
+import re
+import unicodedata
+
+# Streaming bulk loader for a books table (app123's book, library.py's
+# books). Every row carries catalog_key, a 64-bit hash of its normalized
+# title and author, with an index on it; an import looks each batch's keys
+# up in that index instead of holding the catalog in memory, so it runs in
+# constant memory however long the file is.
+
+WORD = re.compile(r"\w+")
+
+
+def normalize(text):
+    """Clean display text: NFKC, control characters as spaces, single spaces."""
+    text = unicodedata.normalize("NFKC", text or "")
+    if not text.isprintable():
+        text = "".join(ch if ch.isprintable() else " " for ch in text)
+    return " ".join(text.split())
+
+
+def catalog_key(title, author):
+    """Signed 64-bit hash that is equal for the same book however it is cased or punctuated."""
+    return _key(normalize(title), normalize(author))
+
+
+def _key(title, author):
+    words = " ".join(WORD.findall(title.casefold())) + "\x1f" + " ".join(WORD.findall(author.casefold()))
+    digest = hashlib.blake2b(words.encode(), digest_size=8).digest()
+    return int.from_bytes(digest, "big", signed=True)
+
+
+def install(con, table):
+    """Add catalog_key and its index to table, and fill in keys for existing rows."""
+    columns = {row[1] for row in con.execute(f"PRAGMA table_info({table})")}
+    if "catalog_key" not in columns:
+        con.execute(f"ALTER TABLE {table} ADD COLUMN catalog_key INTEGER")
+    con.execute(f"CREATE INDEX IF NOT EXISTS ix_{table}_catalog_key ON {table} (catalog_key)")
+    backfill(con, table)
+
+
+def backfill(con, table, batch_size=5000):
+    """Key rows written without one (older rows, raw SQL); returns how many."""
+    done = 0
+    while True:
+        rows = con.execute(f"SELECT id, title, author FROM {table} "
+                           f"WHERE catalog_key IS NULL LIMIT ?", (batch_size,)).fetchall()
+        if not rows:
+            con.commit()
+            return done
+        con.executemany(f"UPDATE {table} SET catalog_key = ? WHERE id = ?",
+                        [(catalog_key(title, author), id) for id, title, author in rows])
+        con.commit()
+        done += len(rows)
+
+
+def read_records(lines, format):
+    """Yield (line number, dict) from a CSV (with a header) or JSONL text stream."""
+    if format == "jsonl":
+        for number, line in enumerate(lines, 1):
+            if line.strip():
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    record = None
+                yield number, record if isinstance(record, dict) else None
+        return
+    reader = csv.DictReader(lines)
+    reader.fieldnames = [field.strip().lower() for field in reader.fieldnames or ()]
+    for record in reader:
+        yield reader.line_num, record
+
+
+def format_for(filename):
+    return "jsonl" if filename.lower().endswith((".jsonl", ".ndjson")) else "csv"
+
+
+def load(con, table, records, batch_size=5000, progress=None):
+    """Insert new books from (line, record) pairs, batch_size per transaction.
+
+    Records need title and author, and may carry copies (default 1) and
+    image. Books whose catalog_key is already in the table, or earlier in
+    the same batch, are counted as duplicates and skipped. progress(stats)
+    is called after every committed batch. Returns the final stats.
+    """
+    columns = {row[1] for row in con.execute(f"PRAGMA table_info({table})")}
+    fields = ["title", "author", "total_copies", "available_copies", "catalog_key"]
+    if "image" in columns:
+        fields.append("image")
+    if "available" in columns:
+        fields.append("available")
+    sql = f"INSERT INTO {table} ({', '.join(fields)}) VALUES ({', '.join('?' * len(fields))})"
+    stats = {"lines": 0, "inserted": 0, "duplicates": 0, "rejected": 0, "first_rejected_line": None}
+
+    def flush(batch):
+        keys = list(batch)
+        existing = set()
+        for start in range(0, len(keys), 500):
+            chunk = keys[start:start + 500]
+            existing.update(row[0] for row in con.execute(
+                f"SELECT catalog_key FROM {table} WHERE catalog_key IN ({','.join('?' * len(chunk))})",
+                chunk))
+        rows = [row for key, row in batch.items() if key not in existing]
+        con.executemany(sql, rows)
+        con.commit()
+        stats["inserted"] += len(rows)
+        stats["duplicates"] += len(batch) - len(rows)
+        if progress is not None:
+            progress(dict(stats))
+
+    batch = {}
+    for line, record in records:
+        stats["lines"] += 1
+        try:
+            title = normalize(str(record.get("title") or ""))
+            author = normalize(str(record.get("author") or ""))
+            copies = int(record.get("copies") or 1)
+            if not title or not author or copies < 1:
+                raise ValueError
+        except (AttributeError, TypeError, ValueError):
+            stats["rejected"] += 1
+            stats["first_rejected_line"] = stats["first_rejected_line"] or line
+            continue
+        key = _key(title, author)
+        if key in batch:
+            stats["duplicates"] += 1
+            continue
+        row = {"title": title, "author": author, "total_copies": copies,
+               "available_copies": copies, "catalog_key": key,
+               "image": normalize(str(record.get("image") or "")), "available": True}
+        batch[key] = tuple(row[field] for field in fields)
+        if len(batch) >= batch_size:
+            flush(batch)
+            batch = {}
+    if batch:
+        flush(batch)
+    return stats
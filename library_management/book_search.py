@@ -0,0 +1,59 @@
+import re
+
+# FTS5 index over a books table's title/author. It is an external-content
+# table: it stores only the inverted index and reads the text back from the
+# books table, and triggers keep it in step with every insert/update/delete.
+
+
+def install(con, table):
+    fts = f"{table}_fts"
+    exists = con.execute("SELECT 1 FROM sqlite_master WHERE name = ?", (fts,)).fetchone()
+    con.execute(
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5("
+        f"title, author, content='{table}', content_rowid='id', "
+        f"tokenize='unicode61 remove_diacritics 2')")
+    con.execute(
+        f"CREATE TRIGGER IF NOT EXISTS {fts}_insert AFTER INSERT ON {table} BEGIN "
+        f"INSERT INTO {fts} (rowid, title, author) VALUES (new.id, new.title, new.author); END")
+    con.execute(
+        f"CREATE TRIGGER IF NOT EXISTS {fts}_delete AFTER DELETE ON {table} BEGIN "
+        f"INSERT INTO {fts} ({fts}, rowid, title, author) "
+        f"VALUES ('delete', old.id, old.title, old.author); END")
+    con.execute(
+        f"CREATE TRIGGER IF NOT EXISTS {fts}_update AFTER UPDATE OF title, author ON {table} BEGIN "
+        f"INSERT INTO {fts} ({fts}, rowid, title, author) "
+        f"VALUES ('delete', old.id, old.title, old.author); "
+        f"INSERT INTO {fts} (rowid, title, author) VALUES (new.id, new.title, new.author); END")
+    if not exists:
+        rebuild(con, table)
+
+
+def rebuild(con, table):
+    """Re-index every row, e.g. for a database that had books before install()."""
+    fts = f"{table}_fts"
+    con.execute(f"INSERT INTO {fts} ({fts}) VALUES ('rebuild')")
+
+
+def match_expression(q):
+    """Turn user input into an FTS5 query: every word must match, the last as a prefix."""
+    words = re.findall(r"\w+", q)
+    if not words:
+        return None
+    terms = [f'"{word}"' for word in words]
+    terms[-1] += "*"
+    return " ".join(terms)
+
+
+def search_query(table, q, limit, offset=0):
+    """(sql, params) for the best bm25 matches for q as (id, title, author), or None."""
+    expression = match_expression(q)
+    if expression is None:
+        return None
+    fts = f"{table}_fts"
+    return (f"SELECT rowid, title, author FROM {fts} WHERE {fts} MATCH ? "
+            f"ORDER BY rank LIMIT ? OFFSET ?", (expression, limit, offset))
+
+
+def search(con, table, q, limit, offset=0):
+    query = search_query(table, q, limit, offset)
+    return con.execute(*query).fetchall() if query else []
@@ -0,0 +1,68 @@
+"""Check that the copies of library_management modules elsewhere in the repo are in sync.
+
+    python check_copies.py
+
+The root app.py (with CRLF line endings) and the modules it imports are
+copies of the files in library_management/, and library_management.py is a
+copy of library.py. Every root .py file with a namesake here is compared,
+ignoring line endings, and every module here that the root app.py imports
+must have a root copy. Exits with status 1 and lists the stale or missing
+copies, if any. bench_env.setup() runs the same check and warns on
+stderr, so every benchmark, stress and audit run reports drift too.
+"""
+import ast
+import glob
+import os
+import sys
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+
+
+def read(path):
+    with open(path, "rb") as f:
+        return f.read().replace(b"\r\n", b"\n")
+
+
+def pairs():
+    yield os.path.join(HERE, "library.py"), os.path.join(HERE, "library_management.py")
+    for copy in sorted(glob.glob(os.path.join(ROOT, "*.py"))):
+        source = os.path.join(HERE, os.path.basename(copy))
+        if os.path.exists(source):
+            yield source, copy
+
+
+def missing():
+    # local modules the root app.py imports that have no copy next to it
+    tree = ast.parse(read(os.path.join(ROOT, "app.py")))
+    names = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            names.update(alias.name.split(".")[0] for alias in node.names)
+        elif isinstance(node, ast.ImportFrom) and node.module and not node.level:
+            names.add(node.module.split(".")[0])
+    return sorted(name for name in names
+                  if os.path.exists(os.path.join(HERE, name + ".py"))
+                  and not os.path.exists(os.path.join(ROOT, name + ".py")))
+
+
+def problems():
+    """Describe each stale or missing copy, one line apiece."""
+    found = [f"{os.path.relpath(copy, ROOT)} differs from {os.path.relpath(source, ROOT)}"
+             for source, copy in pairs() if read(source) != read(copy)]
+    found += [f"app.py imports {name}, but there is no {name}.py next to it" for name in missing()]
+    return found
+
+
+def main():
+    found = problems()
+    for line in found:
+        print(line)
+    if found:
+        return 1
+    print("all copies match")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,135 @@
+"""Hammer app123's issue/return from many threads and check that no update is lost.
+
+    python circulation_stress.py [--clients 16] [--seconds 5] [--books 3] [--copies 2]
+
+Every client thread is a logged-in student that keeps issuing a random
+title of a small, heavily contended catalog through GET /issue/<id> and
+returning copies it holds through GET /return/<id>, as a threaded gunicorn
+worker would serve them. Each thread counts what the app told it; at the
+end the database must agree: for every title, free copies plus open loans
+equal the stock, every successful issue opened exactly one loan and every
+successful return closed exactly one, each student's open loans match its
+own count, and no request failed with anything but 302 or 409. Prints
+issues/returns per second and how many attempts lost the race (409).
+"""
+import argparse
+import logging
+import random
+import sys
+import threading
+import time
+from collections import Counter
+
+import bench_env
+
+
+def run(app123, students, book_ids, seconds):
+    stop = time.monotonic() + seconds
+    results = []
+    lock = threading.Lock()
+
+    def client(name, seed):
+        rng = random.Random(seed)
+        c = app123.app.test_client()
+        with c.session_transaction() as s:
+            s["user"], s["role"] = name, "student"
+        held = Counter()
+        counts = Counter()
+        while time.monotonic() < stop:
+            book = rng.choice(book_ids)
+            if held[book] and rng.random() < 0.5:
+                status = c.get(f"/return/{book}").status_code
+                kind = "return"
+                if status == 302:
+                    held[book] -= 1
+            else:
+                status = c.get(f"/issue/{book}").status_code
+                kind = "issue"
+                if status == 302:
+                    held[book] += 1
+            counts[(kind, status)] += 1
+        with lock:
+            results.append((name, held, counts))
+
+    threads = [threading.Thread(target=client, args=(name, i)) for i, name in enumerate(students)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def check(app123, results, copies):
+    from app123 import Book, Loan, User, db
+    errors = []
+    with app123.app.app_context():
+        totals = Counter()
+        for name, held, counts in results:
+            totals.update(counts)
+            user_id = User.query.filter_by(username=name).one().id
+            for book, n in held.items():
+                open_loans = Loan.query.filter_by(book_id=book, user_id=user_id, returned_at=None).count()
+                if open_loans != n:
+                    errors.append(f"{name} holds {n} of book {book} but has {open_loans} open loans")
+        for book in Book.query.all():
+            open_loans = Loan.query.filter_by(book_id=book.id, returned_at=None).count()
+            if book.total_copies != copies or book.available_copies + open_loans != copies:
+                errors.append(f"book {book.id}: {book.available_copies} free + {open_loans} on loan "
+                              f"!= {copies} copies")
+        loans = Loan.query.count()
+        returned = Loan.query.filter(Loan.returned_at.isnot(None)).count()
+        if loans != totals[("issue", 302)]:
+            errors.append(f"{totals[('issue', 302)]} successful issues opened {loans} loans")
+        if returned != totals[("return", 302)]:
+            errors.append(f"{totals[('return', 302)]} successful returns closed {returned} loans")
+        unexpected = {key: n for key, n in totals.items() if key[1] not in (302, 409)}
+        if unexpected:
+            errors.append(f"unexpected responses: {unexpected}")
+        db.session.remove()
+    return totals, errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--clients", type=int, default=16)
+    parser.add_argument("--seconds", type=float, default=5)
+    parser.add_argument("--books", type=int, default=3, help="titles in the contended catalog")
+    parser.add_argument("--copies", type=int, default=2, help="copies of each title")
+    args = parser.parse_args()
+
+    bench_env.setup("circulation_stress")
+
+    import app123
+    from app123 import Book, User, db
+
+    # under this much contention every statement queues for the write lock
+    logging.getLogger("sql").setLevel(logging.ERROR)
+
+    app123.setup_db()
+    students = [f"student{i}" for i in range(args.clients)]
+    with app123.app.app_context():
+        for name in students:
+            db.session.add(User(username=name, password="-", role="student"))
+        books = [Book(title=f"Contended {i}", author="Stress", image="", total_copies=args.copies,
+                      available_copies=args.copies) for i in range(args.books)]
+        db.session.add_all(books)
+        db.session.commit()
+        book_ids = [book.id for book in books]
+
+    results = run(app123, students, book_ids, args.seconds)
+    totals, errors = check(app123, results, args.copies)
+
+    print(f"{args.clients} clients, {args.books} titles x {args.copies} copies, {args.seconds:g}s")
+    for kind in ("issue", "return"):
+        ok, lost = totals[(kind, 302)], totals[(kind, 409)]
+        print(f"{kind:7s} {ok / args.seconds:8.1f}/s ok  {lost / args.seconds:8.1f}/s lost the race (409)")
+    for error in errors:
+        print("FAIL", error)
+    if errors:
+        return 1
+    print("no lost updates")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
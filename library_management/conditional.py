@@ -0,0 +1,34 @@
+import hashlib
+from functools import wraps
+
+from flask import make_response, request
+
+
+def conditional(key):
+    """Answer GETs with a strong ETag and turn matching If-None-Match into a 304.
+
+    key() runs before the view and returns what the page depends on (table
+    versions, role, ...), or None when no ETag should be used. It is hashed
+    together with the request path and query string, so a browser that
+    already holds the current page gets a 304 without the view running any
+    query or render.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            parts = key() if request.method == "GET" else None
+            if parts is None:
+                return view(*args, **kwargs)
+            etag = hashlib.sha1(repr((parts, request.full_path)).encode()).hexdigest()
+            if request.if_none_match.contains(etag):
+                response = make_response("", 304)
+            else:
+                response = make_response(view(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+            response.set_etag(etag)
+            response.headers["Cache-Control"] = "private, no-cache"
+            response.vary.add("Cookie")
+            return response
+        return wrapper
+    return decorator
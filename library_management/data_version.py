@@ -0,0 +1,89 @@
+import os
+import sqlite3
+import threading
+
+
+class DataVersionWatcher:
+    """Notice writes made by other connections and processes to one SQLite file.
+
+    PRAGMA data_version on a connection changes whenever any *other*
+    connection commits to the database, so a dedicated, never-writing
+    connection per worker sees every commit from every gunicorn worker and
+    from this worker's own pool. The check reads no table pages, which makes
+    it cheap enough to run at the start of each request. Subscribers (cache
+    invalidators) are called whenever the value moves.
+    """
+
+    def __init__(self, database):
+        self.database = database
+        self.generation = 0
+        self._lock = threading.Lock()
+        self._listeners = []
+        self._con = None
+        self._pid = None
+        self._last = None
+        self._versions = {}
+
+    def _read(self):
+        # connections must not cross a fork (gunicorn --preload)
+        if self._con is None or self._pid != os.getpid():
+            self._con = sqlite3.connect(self.database, check_same_thread=False)
+            self._pid = os.getpid()
+            self._last = None
+        return self._con.execute("PRAGMA data_version").fetchone()[0]
+
+    def subscribe(self, callback):
+        self._listeners.append(callback)
+
+    def check(self):
+        with self._lock:
+            current = self._read()
+            if current == self._last:
+                return False
+            # a fresh connection has no baseline, so it invalidates too
+            self._last = current
+            self._versions.clear()
+            self.generation += 1
+        for callback in self._listeners:
+            callback()
+        return True
+
+    def track(self, *tables):
+        """Keep a per-table version in table_versions, bumped by triggers on every write.
+
+        Unlike data_version or generation, these numbers are stored in the
+        database, so every worker sees the same value for the same state.
+        """
+        con = sqlite3.connect(self.database)
+        with con:
+            con.execute("CREATE TABLE IF NOT EXISTS table_versions "
+                        "(name TEXT PRIMARY KEY, version INTEGER NOT NULL DEFAULT 0)")
+            for table in tables:
+                con.execute("INSERT OR IGNORE INTO table_versions (name) VALUES (?)", (table,))
+                for op in ("INSERT", "UPDATE", "DELETE"):
+                    con.execute(
+                        f"CREATE TRIGGER IF NOT EXISTS {table}_version_{op.lower()} "
+                        f"AFTER {op} ON {table} BEGIN "
+                        f"UPDATE table_versions SET version = version + 1 WHERE name = '{table}'; END")
+        con.close()
+
+    def table_version(self, name):
+        """Stored version of a tracked table, or None if it is not tracked.
+
+        Cached until the next check() sees the database change.
+        """
+        with self._lock:
+            if name not in self._versions:
+                self._read()
+                try:
+                    row = self._con.execute(
+                        "SELECT version FROM table_versions WHERE name = ?", (name,)).fetchone()
+                except sqlite3.OperationalError:
+                    row = None
+                self._versions[name] = row[0] if row else None
+            return self._versions[name]
+
+    def init_app(self, app):
+        @app.before_request
+        def _check_data_version():
+            self.check()
@@ -0,0 +1,130 @@
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+log = logging.getLogger("dbpool")
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+class ConnectionPool:
+    """Bounded pool of sqlite3 connections shared by the threads of one worker."""
+
+    def __init__(self, database, max_size=5, timeout=10.0, leak_timeout=30.0, setup=None,
+                 factory=sqlite3.Connection):
+        self.database = database
+        self.setup = setup
+        self.factory = factory
+        self.max_size = max_size
+        self.timeout = timeout
+        self.leak_timeout = leak_timeout
+        self._cond = threading.Condition()
+        self._idle = []
+        self._in_use = {}
+        self._open = 0
+        self._pid = os.getpid()
+        # connections opened before a fork; kept referenced so the child never
+        # closes (and so never touches) the parent's SQLite handles
+        self._inherited = []
+        self._stats = {"checkouts": 0, "waits": 0, "timeouts": 0,
+                       "opened": 0, "leaks": 0}
+
+    def _connect(self):
+        con = sqlite3.connect(self.database, check_same_thread=False, factory=self.factory)
+        if self.setup is not None:
+            self.setup(con)
+        return con
+
+    def _after_fork(self):
+        # connections must not cross a fork (gunicorn --preload): start empty
+        self._cond = threading.Condition()
+        self._inherited.extend(self._idle)
+        self._inherited.extend(con for con, _, _, _ in self._in_use.values())
+        self._idle = []
+        self._in_use = {}
+        self._open = 0
+        self._pid = os.getpid()
+
+    def acquire(self, label=None):
+        if self._pid != os.getpid():
+            self._after_fork()
+        con = None
+        with self._cond:
+            self._check_leaks()
+            deadline = time.monotonic() + self.timeout
+            waited = False
+            while not self._idle and self._open >= self.max_size:
+                if not waited:
+                    self._stats["waits"] += 1
+                    waited = True
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._stats["timeouts"] += 1
+                    raise PoolTimeout(f"no connection to {self.database} free after {self.timeout}s")
+                self._cond.wait(remaining)
+            if self._idle:
+                con = self._idle.pop()
+            else:
+                self._open += 1
+        if con is None:
+            try:
+                con = self._connect()
+            except Exception:
+                with self._cond:
+                    self._open -= 1
+                    self._cond.notify()
+                raise
+            with self._cond:
+                self._stats["opened"] += 1
+        with self._cond:
+            self._in_use[id(con)] = (con, time.monotonic(), label, False)
+            self._stats["checkouts"] += 1
+        return con
+
+    def release(self, con):
+        if self._pid != os.getpid() or id(con) not in self._in_use:
+            # checked out before a fork: not this process's to roll back or reuse
+            self._inherited.append(con)
+            return
+        try:
+            if con.in_transaction:
+                con.rollback()
+        except sqlite3.Error:
+            # broken connection: drop it and let the next acquire open a new one
+            with self._cond:
+                self._in_use.pop(id(con), None)
+                self._open -= 1
+                self._cond.notify()
+            con.close()
+            return
+        with self._cond:
+            self._in_use.pop(id(con), None)
+            self._idle.append(con)
+            self._cond.notify()
+
+    def _check_leaks(self):
+        # called with the lock held; each leaked checkout is reported once
+        now = time.monotonic()
+        for key, (con, since, label, reported) in list(self._in_use.items()):
+            if not reported and now - since > self.leak_timeout:
+                self._stats["leaks"] += 1
+                self._in_use[key] = (con, since, label, True)
+                log.warning("connection to %s held for %.1fs (checked out by %s)",
+                            self.database, now - since, label or "unknown")
+
+    def stats(self):
+        with self._cond:
+            self._check_leaks()
+            return dict(self._stats, open=self._open, idle=len(self._idle),
+                        in_use=len(self._in_use), max_size=self.max_size)
+
+    def close(self):
+        with self._cond:
+            for con in self._idle:
+                con.close()
+            self._open -= len(self._idle)
+            self._idle.clear()
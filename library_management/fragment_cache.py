@@ -0,0 +1,41 @@
+import threading
+
+
+class VersionedCache:
+    """Rendered fragments keyed by name and tagged with a data version.
+
+    Writers call bump() after they commit; every entry rendered against an
+    older version is then treated as a miss and rebuilt on next use.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = {}
+        self.version = 0
+        self.hits = 0
+        self.misses = 0
+
+    def bump(self):
+        with self._lock:
+            self.version += 1
+            self._entries.clear()
+
+    def get(self, key, build):
+        with self._lock:
+            version = self.version
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == version:
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+        value = build()
+        with self._lock:
+            # a write that landed while we were building makes this stale
+            if self.version == version:
+                self._entries[key] = (version, value)
+        return value
+
+    def stats(self):
+        with self._lock:
+            return {"version": self.version, "hits": self.hits,
+                    "misses": self.misses, "entries": len(self._entries)}
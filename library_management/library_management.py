@@ -1,15 +1,163 @@
-from flask import Flask, request, redirect, session
+from flask import Flask, request, redirect, session, g, jsonify
+from markupsafe import escape
+from werkzeug.middleware.proxy_fix import ProxyFix
+from urllib.parse import urlencode
+from dbpool import ConnectionPool
+from fragment_cache import VersionedCache
+from data_version import DataVersionWatcher
+from group_commit import GroupCommitWriter
+import book_search
+import book_import
+import click
+import csv
+import io
+from conditional import conditional
+from passwords import PasswordHasher, HasherBusy
+from rate_limit import RateLimiter
+from metrics import Metrics
+from sql_hooks import QueryHooks
+from sql_trace import QueryTracer
+from server_timing import ServerTiming
+import sqlite_profile
+import os
 import sqlite3
+import tempfile
 
 app = Flask(__name__)
 app.secret_key = "library_secret_key"
 
+app.config["DATABASE"] = os.environ.get("LIBRARY_DB", "library.db")
+app.config["DB_POOL_SIZE"] = int(os.environ.get("DB_POOL_SIZE", 5))
+app.config["DB_POOL_TIMEOUT"] = float(os.environ.get("DB_POOL_TIMEOUT", 10))
+app.config["DB_LEAK_TIMEOUT"] = float(os.environ.get("DB_LEAK_TIMEOUT", 30))
+app.config["SQLITE_PROFILE"] = os.environ.get("SQLITE_PROFILE", "throughput")
+app.config["SEARCH_PAGE_SIZE"] = int(os.environ.get("SEARCH_PAGE_SIZE", 20))
+app.config["GROUP_COMMIT"] = os.environ.get("GROUP_COMMIT", "0") == "1"
+app.config["GROUP_COMMIT_MAX_ROWS"] = int(os.environ.get("GROUP_COMMIT_MAX_ROWS", 200))
+app.config["GROUP_COMMIT_MAX_DELAY_MS"] = float(os.environ.get("GROUP_COMMIT_MAX_DELAY_MS", 5))
+# scrypt N = 2**PASSWORD_HASH_COST, hashed in PASSWORD_HASH_WORKERS processes per worker
+app.config["PASSWORD_HASH_COST"] = int(os.environ.get("PASSWORD_HASH_COST", 15))
+app.config["PASSWORD_HASH_WORKERS"] = int(os.environ.get("PASSWORD_HASH_WORKERS", 2))
+# login/registration throttling; buckets shared by all workers through RATE_LIMIT_DB
+app.config["RATE_LIMIT"] = os.environ.get("RATE_LIMIT", "1") == "1"
+app.config["RATE_LIMIT_DB"] = os.environ.get(
+    "RATE_LIMIT_DB", os.path.join(tempfile.gettempdir(), "library-ratelimit.db"))
+app.config["RATE_LIMIT_IP"] = os.environ.get("RATE_LIMIT_IP", "20/60")
+app.config["RATE_LIMIT_ACCOUNT"] = os.environ.get("RATE_LIMIT_ACCOUNT", "5/60")
+# reverse proxies in front of the app that append to X-Forwarded-For; the limiter
+# keys on the client address they report (0 = clients connect directly)
+app.config["TRUSTED_PROXIES"] = int(os.environ.get("TRUSTED_PROXIES", 0))
+# /metrics; every worker of one gunicorn master must share METRICS_DIR ("" = per process)
+app.config["METRICS_DIR"] = os.environ.get(
+    "METRICS_DIR", os.path.join(tempfile.gettempdir(), "library-metrics"))
+# SQL log: statements slower than SQL_SLOW_MS, and templates run more than SQL_REPEAT_LIMIT times per request
+app.config["SQL_SLOW_MS"] = float(os.environ.get("SQL_SLOW_MS", 100))
+app.config["SQL_REPEAT_LIMIT"] = int(os.environ.get("SQL_REPEAT_LIMIT", 10))
+# Server-Timing header (db, render, session, total); off by default, it exposes timings to clients
+app.config["SERVER_TIMING"] = os.environ.get("SERVER_TIMING", "0") == "1"
+
 # ================= DATABASE =================
+metrics = Metrics("library", app.config["METRICS_DIR"])
+# pooled connections time every statement for metrics, the SQL log and Server-Timing
+query_hooks = QueryHooks()
+query_tracer = QueryTracer(app.config["SQL_SLOW_MS"], app.config["SQL_REPEAT_LIMIT"])
+query_tracer.init_app(app)
+query_hooks.subscribe(metrics.record_query)
+query_hooks.subscribe(query_tracer.record_query)
+server_timing = ServerTiming()
+if app.config["SERVER_TIMING"]:
+    server_timing.init_app(app, query_hooks)
+
+pool = ConnectionPool(
+    app.config["DATABASE"],
+    max_size=app.config["DB_POOL_SIZE"],
+    timeout=app.config["DB_POOL_TIMEOUT"],
+    leak_timeout=app.config["DB_LEAK_TIMEOUT"],
+    setup=lambda con: sqlite_profile.apply_profile(con, app.config["SQLITE_PROFILE"]),
+    factory=query_hooks.connection_factory,
+)
+
+# one pooled connection per request, handed back in close_db()
 def get_db():
-    return sqlite3.connect("library.db", check_same_thread=False)
+    if "db" not in g:
+        g.db = pool.acquire(label=request.path if request else None)
+    return g.db
 
-def init_db():
+@app.teardown_appcontext
+def close_db(exc):
+    con = g.pop("db", None)
+    if con is not None:
+        pool.release(con)
+
+# with GROUP_COMMIT=1, inserts from concurrent requests share one transaction
+writer = None
+if app.config["GROUP_COMMIT"]:
+    writer = GroupCommitWriter(
+        app.config["DATABASE"],
+        setup=lambda con: sqlite_profile.apply_profile(con, app.config["SQLITE_PROFILE"]),
+        max_rows=app.config["GROUP_COMMIT_MAX_ROWS"],
+        max_delay=app.config["GROUP_COMMIT_MAX_DELAY_MS"] / 1000,
+    )
+
+def insert(sql, params):
+    if writer is not None:
+        return writer.submit(sql, params)
     con = get_db()
+    rowid = con.execute(sql, params).lastrowid
+    con.commit()
+    return rowid
+
+hasher = PasswordHasher(app.config["PASSWORD_HASH_COST"], app.config["PASSWORD_HASH_WORKERS"])
+limiter = RateLimiter(app.config["RATE_LIMIT_DB"], app.config["RATE_LIMIT_IP"],
+                      app.config["RATE_LIMIT_ACCOUNT"])
+if app.config["TRUSTED_PROXIES"]:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=app.config["TRUSTED_PROXIES"])
+if app.config["RATE_LIMIT"]:
+    limiter.init_app(app)
+# after the limiter, so its hook goes in ahead of it and 429s are counted
+metrics.init_app(app)
+
+def check_login(email, password, role):
+    """The users row for a correct email/password/role, else None. Raises HasherBusy."""
+    con = get_db()
+    user = con.execute("SELECT * FROM users WHERE email=? AND role=?", (email, role)).fetchone()
+    ok, rehash = hasher.verify(user[3] if user else None, password)
+    if ok and rehash and not sqlite_profile.read_only(app.config["SQLITE_PROFILE"]):
+        # legacy plaintext or an old cost: upgrade while we know the password;
+        # if the write fails the login still counts, the next one retries
+        try:
+            con.execute("UPDATE users SET password=? WHERE id=? AND password=?",
+                        (hasher.hash(password), user[0], user[3]))
+            con.commit()
+        except sqlite3.OperationalError:
+            con.rollback()
+            app.logger.warning("could not upgrade the password hash of user %s", user[0], exc_info=True)
+    return user if ok else None
+
+# rendered <li> list of books per dashboard; admin() bumps it on insert and
+# the watcher bumps it when another worker writes to library.db
+catalog_cache = VersionedCache()
+watcher = DataVersionWatcher(app.config["DATABASE"])
+watcher.subscribe(catalog_cache.bump)
+watcher.init_app(app)
+
+def render_catalog(role):
+    def build():
+        books = get_db().execute(
+            "SELECT title, author, available_copies, total_copies FROM books").fetchall()
+        with server_timing.phase("render"):
+            return ''.join([f"<li>{b[0]} by {b[1]} ({b[2]}/{b[3]} available)</li>" for b in books])
+    return catalog_cache.get(role, build)
+
+def init_db():
+    con = pool.acquire(label="init_db")
+    sqlite_profile.verify_profile(con, app.config["SQLITE_PROFILE"])
+    with sqlite_profile.writable(con):
+        create_schema(con)
+    pool.release(con)
+    watcher.track("books")
+
+def create_schema(con):
     cur = con.cursor()
 
     cur.execute("""
@@ -26,15 +174,62 @@ def init_db():
     CREATE TABLE IF NOT EXISTS books (
         id INTEGER PRIMARY KEY AUTOINCREMENT,
         title TEXT,
-        author TEXT
+        author TEXT,
+        total_copies INTEGER NOT NULL DEFAULT 1,
+        available_copies INTEGER NOT NULL DEFAULT 1
+            CHECK (available_copies BETWEEN 0 AND total_copies),
+        catalog_key INTEGER
     )
     """)
 
+    # books tables from before multi-copy inventory: one copy per row
+    columns = {row[1] for row in cur.execute("PRAGMA table_info(books)")}
+    for column in ("total_copies", "available_copies"):
+        if column not in columns:
+            cur.execute(f"ALTER TABLE books ADD COLUMN {column} INTEGER NOT NULL DEFAULT 1")
+
+    book_search.install(con, "books")
+    book_import.install(con, "books")
+
     con.commit()
-    con.close()
 
 init_db()
 
+@app.cli.command("rebuild-search")
+def rebuild_search():
+    """Re-index every book for /search."""
+    con = pool.acquire(label="rebuild-search")
+    book_search.rebuild(con, "books")
+    con.commit()
+    pool.release(con)
+
+@app.cli.command("import-books")
+@click.argument("path", type=click.Path(exists=True, dir_okay=False))
+@click.option("--format", "format", type=click.Choice(["csv", "jsonl"]), default=None,
+              help="Defaults to the file extension.")
+@click.option("--batch-size", type=int, default=5000, help="Books per transaction.")
+def import_books(path, format, batch_size):
+    """Bulk-load books from CSV/JSONL with title, author and optional copies."""
+    def progress(stats):
+        click.echo(f"{stats['lines']} lines: {stats['inserted']} new, "
+                   f"{stats['duplicates']} duplicates, {stats['rejected']} rejected")
+    con = pool.acquire(label="import-books")
+    try:
+        with open(path, newline="", encoding="utf-8-sig") as lines:
+            records = book_import.read_records(lines, format or book_import.format_for(path))
+            book_import.load(con, "books", records, batch_size, progress)
+    finally:
+        pool.release(con)
+
+# dashboards depend only on the books table and who is looking
+def dashboard_key(role):
+    def key():
+        version = watcher.table_version("books")
+        if role not in session or version is None:
+            return None
+        return version, role
+    return key
+
 # ================= CSS =================
 css = """
 <style>
@@ -86,6 +281,7 @@ def home():
 
 # ================= REGISTER =================
 @app.route("/register", methods=["GET","POST"])
+@limiter.limit(account=lambda: request.form.get("email"))
 def register():
     if request.method == "POST":
         name = request.form["name"].strip()
@@ -94,13 +290,14 @@ def register():
         role = request.form["role"].strip()
 
         try:
-            con = get_db()
-            con.execute(
+            password = hasher.hash(password)
+        except HasherBusy:
+            return css + "<div class='container'><h3>Too many sign-ups right now, please try again</h3></div>", 503
+        try:
+            insert(
                 "INSERT INTO users (name,email,password,role) VALUES (?,?,?,?)",
                 (name,email,password,role)
             )
-            con.commit()
-            con.close()
             return redirect("/")
         except Exception as e:
             return css + f"<div class='container'><h3>User already exists</h3><a href='/register'>Back</a></div>"
@@ -124,19 +321,16 @@ def register():
 
 # ================= STUDENT LOGIN =================
 @app.route("/login/student", methods=["GET","POST"])
+@limiter.limit(account=lambda: request.form.get("email"))
 def student_login():
     if request.method == "POST":
         email = request.form["email"].strip()
         password = request.form["password"].strip()
 
-        con = get_db()
-        cur = con.cursor()
-        cur.execute(
-            "SELECT * FROM users WHERE email=? AND password=? AND role='student'",
-            (email,password)
-        )
-        user = cur.fetchone()
-        con.close()
+        try:
+            user = check_login(email, password, "student")
+        except HasherBusy:
+            return css + "<div class='container'><h3>Too many logins right now, please try again</h3></div>", 503
 
         if user:
             session["student"] = user[1]
@@ -158,19 +352,16 @@ def student_login():
 
 # ================= ADMIN LOGIN =================
 @app.route("/login/admin", methods=["GET","POST"])
+@limiter.limit(account=lambda: request.form.get("email"))
 def admin_login():
     if request.method == "POST":
         email = request.form["email"].strip()
         password = request.form["password"].strip()
 
-        con = get_db()
-        cur = con.cursor()
-        cur.execute(
-            "SELECT * FROM users WHERE email=? AND password=? AND role='admin'",
-            (email,password)
-        )
-        admin = cur.fetchone()
-        con.close()
+        try:
+            admin = check_login(email, password, "admin")
+        except HasherBusy:
+            return css + "<div class='container'><h3>Too many logins right now, please try again</h3></div>", 503
 
         if admin:
             session["admin"] = admin[1]
@@ -192,6 +383,7 @@ def admin_login():
 
 # ================= ADMIN DASHBOARD =================
 @app.route("/admin", methods=["GET","POST"])
+@conditional(dashboard_key("admin"))
 def admin():
     if "admin" not in session:
         return redirect("/")
@@ -199,15 +391,12 @@ def admin():
     if request.method == "POST":
         title = request.form["title"].strip()
         author = request.form["author"].strip()
-        con = get_db()
-        con.execute(
-            "INSERT INTO books (title,author) VALUES (?,?)",
-            (title,author)
+        copies = max(1, request.form.get("copies", 1, type=int))
+        insert(
+            "INSERT INTO books (title,author,total_copies,available_copies,catalog_key) VALUES (?,?,?,?,?)",
+            (title,author,copies,copies,book_import.catalog_key(title, author))
         )
-        con.commit()
-        con.close()
-
-    books = get_db().execute("SELECT * FROM books").fetchall()
+        catalog_cache.bump()
 
     return css + f"""
     <div class="container">
@@ -215,33 +404,110 @@ def admin():
         <form method="post">
             <input name="title" placeholder="Book Title">
             <input name="author" placeholder="Author">
+            <input type="number" name="copies" min="1" value="1" placeholder="Copies">
             <button>Add Book</button>
         </form>
+        <form method="post" action="/admin/import" enctype="multipart/form-data">
+            <input type="file" name="file" accept=".csv,.jsonl,.ndjson">
+            <button>Import CSV/JSONL</button>
+        </form>
+        <form action="/search">
+            <input name="q" placeholder="Search title or author">
+        </form>
         <ul>
-            {''.join([f"<li>{b[1]} by {b[2]}</li>" for b in books])}
+            {render_catalog("admin")}
         </ul>
         <a href="/logout">Logout</a>
     </div>
     """
 
+@app.route("/admin/import", methods=["POST"])
+def admin_import():
+    if "admin" not in session:
+        return redirect("/")
+    upload = request.files.get("file")
+    if upload is None:
+        return jsonify(error="upload a CSV or JSONL file as 'file'"), 400
+    lines = io.TextIOWrapper(upload.stream, encoding="utf-8-sig", newline="")
+    records = book_import.read_records(lines, book_import.format_for(upload.filename or ""))
+    progress = lambda stats: app.logger.info("book import %s: %s", upload.filename, stats)
+    try:
+        stats = book_import.load(get_db(), "books", records, progress=progress)
+    except (UnicodeDecodeError, csv.Error) as e:
+        return jsonify(error=str(e)), 400
+    catalog_cache.bump()
+    return jsonify(stats)
+
 # ================= STUDENT DASHBOARD =================
 @app.route("/student")
+@conditional(dashboard_key("student"))
 def student():
     if "student" not in session:
         return redirect("/")
 
-    books = get_db().execute("SELECT * FROM books").fetchall()
-
     return css + f"""
     <div class="container">
         <h3>Student Dashboard</h3>
+        <form action="/search">
+            <input name="q" placeholder="Search title or author">
+        </form>
         <ul>
-            {''.join([f"<li>{b[1]} by {b[2]}</li>" for b in books])}
+            {render_catalog("student")}
         </ul>
         <a href="/logout">Logout</a>
     </div>
     """
 
+# ================= SEARCH =================
+@app.route("/search")
+def search():
+    if "admin" not in session and "student" not in session:
+        return redirect("/")
+    q = request.args.get("q", "").strip()
+    page = max(1, request.args.get("page", 1, type=int))
+    size = app.config["SEARCH_PAGE_SIZE"]
+    hits = book_search.search(get_db(), "books", q, size + 1, (page - 1) * size)
+    with server_timing.phase("render"):
+        items = ''.join([f"<li>{escape(b[1])} by {escape(b[2])}</li>" for b in hits[:size]])
+    pages = ""
+    if page > 1:
+        pages += f"<a href='/search?{urlencode({'q': q, 'page': page - 1})}'>Previous</a>"
+    if len(hits) > size:
+        pages += f"<a href='/search?{urlencode({'q': q, 'page': page + 1})}'>Next</a>"
+
+    return css + f"""
+    <div class="container">
+        <h3>Search</h3>
+        <form action="/search">
+            <input name="q" value="{escape(q)}" placeholder="Search title or author">
+        </form>
+        <ul>
+            {items or "<li>No books found</li>"}
+        </ul>
+        {pages}
+        <a href="{'/admin' if 'admin' in session else '/student'}">Back</a>
+    </div>
+    """
+
+# ================= STATS =================
+@app.route("/admin/pool")
+def pool_stats():
+    if "admin" not in session:
+        return redirect("/")
+    return jsonify(pool.stats())
+
+@app.route("/admin/cache")
+def cache_stats():
+    if "admin" not in session:
+        return redirect("/")
+    return jsonify(catalog_cache.stats())
+
+@app.route("/admin/group-commit")
+def group_commit_stats():
+    if "admin" not in session:
+        return redirect("/")
+    return jsonify(writer.stats() if writer is not None else {"enabled": False})
+
 # ================= LOGOUT =================
 @app.route("/logout")
 def logout():
@@ -0,0 +1,75 @@
+"""Measure /list latency as the registration table grows from 1k to 1M rows.
+
+    python list_bench.py [--sizes 1000,10000,100000,1000000] [--requests 200]
+
+Imports app.py against a scratch database and grows the registration table
+to each size in turn with plain INSERTs. At every size it times GET /list
+through the Flask test client for the first page, a page in the middle of
+the table (after=<id>) and a page sorted by name, and prints the median and
+95th percentile in ms. With keyset pagination the numbers should stay flat
+however large the table gets.
+"""
+import argparse
+import os
+import random
+import sqlite3
+import statistics
+import sys
+import time
+
+import bench_env
+
+NAMES = ["Ada", "Grace", "Alan", "Edsger", "Barbara", "Donald", "Ken", "Margaret", "Linus", "Guido"]
+DOMAINS = ["example.com", "mail.org", "uni.edu", "corp.net"]
+
+
+def grow(database, size):
+    con = sqlite3.connect(database)
+    have = con.execute("SELECT count(*) FROM registration").fetchone()[0]
+    rng = random.Random(have)
+    rows = ((f"{rng.choice(NAMES)} {i}", f"user{i}@{rng.choice(DOMAINS)}", f"555{i:07d}",
+             rng.choice(("male", "female")))
+            for i in range(have, size))
+    with con:
+        con.executemany("INSERT INTO registration (name, email, phone, gender) VALUES (?, ?, ?, ?)", rows)
+    middle = con.execute("SELECT id FROM registration ORDER BY id LIMIT 1 OFFSET ?", (size // 2,)).fetchone()[0]
+    con.close()
+    return middle
+
+
+def timed(client, url, requests):
+    client.get(url)  # compile the template outside the timings
+    samples = []
+    for _ in range(requests):
+        started = time.perf_counter()
+        status = client.get(url).status_code
+        samples.append((time.perf_counter() - started) * 1000)
+        assert status == 200, (url, status)
+    samples.sort()
+    return statistics.median(samples), samples[int(len(samples) * 0.95) - 1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", default="1000,10000,100000,1000000", help="comma-separated row counts")
+    parser.add_argument("--requests", type=int, default=200, help="timed requests per page and size")
+    args = parser.parse_args()
+
+    bench_env.setup("list_bench")
+    database = os.environ["REGISTRATIONS_DB"]
+
+    import app
+
+    client = app.app.test_client()
+    print("rows       first page       middle page      sort=name")
+    print("           median    p95    median    p95    median    p95")
+    for size in (int(s) for s in args.sizes.split(",")):
+        middle = grow(database, size)
+        results = [timed(client, url, args.requests)
+                   for url in ("/list", f"/list?after={middle}", "/list?sort=name")]
+        print(f"{size:<9d}" + "".join(f"  {median:7.2f} {p95:6.2f}" for median, p95 in results))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,73 @@
+"""Measure logins/sec against the number of password hashing processes.
+
+    python login_bench.py [--cost 15] [--clients 16] [--seconds 5] [--workers 1,2,4,8]
+
+Drives app123's login() from `clients` threads with the Flask test client,
+as a threaded gunicorn worker would, against a scratch database. For every
+pool size it swaps in a fresh PasswordHasher, runs for `seconds` and prints
+successful logins/sec, HasherBusy (503) answers and the mean latency.
+"""
+import argparse
+import os
+import sys
+import threading
+import time
+
+import bench_env
+
+
+def run(app123, clients, seconds):
+    stop = time.monotonic() + seconds
+    counts = {"ok": 0, "busy": 0, "other": 0, "latency": 0.0}
+    lock = threading.Lock()
+
+    def client():
+        c = app123.app.test_client()
+        form = {"username": "bench", "password": "bench-password", "role": "student"}
+        while time.monotonic() < stop:
+            started = time.monotonic()
+            status = c.post("/", data=form).status_code
+            elapsed = time.monotonic() - started
+            key = "ok" if status == 302 else "busy" if status == 503 else "other"
+            with lock:
+                counts[key] += 1
+                counts["latency"] += elapsed
+
+    threads = [threading.Thread(target=client) for _ in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--cost", type=int, default=15, help="scrypt N = 2**cost")
+    parser.add_argument("--clients", type=int, default=16)
+    parser.add_argument("--seconds", type=float, default=5)
+    parser.add_argument("--workers", default="1,2,4,8", help="comma-separated pool sizes")
+    args = parser.parse_args()
+
+    bench_env.setup("login_bench", PASSWORD_HASH_COST=args.cost)
+
+    import app123
+    from passwords import PasswordHasher
+
+    app123.setup_db()
+    app123.app.test_client().post("/register", data={"username": "bench", "password": "bench-password"})
+
+    print(f"scrypt N=2**{args.cost}, {args.clients} client threads, {os.cpu_count()} CPUs")
+    print("workers  logins/s  busy  mean ms")
+    for workers in (int(w) for w in args.workers.split(",")):
+        app123.hasher = PasswordHasher(args.cost, workers)
+        counts = run(app123, args.clients, args.seconds)
+        app123.hasher.close()
+        requests = counts["ok"] + counts["busy"] + counts["other"]
+        print(f"{workers:7d}  {counts['ok'] / args.seconds:8.1f}  {counts['busy']:4d}  "
+              f"{counts['latency'] * 1000 / max(requests, 1):7.1f}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,100 @@
+import hmac
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from werkzeug.security import check_password_hash, generate_password_hash
+
+HASH_PREFIXES = ("scrypt:", "pbkdf2:")
+
+
+class HasherBusy(Exception):
+    pass
+
+
+def _method(cost):
+    # scrypt with N = 2**cost; 15 is werkzeug's default
+    return f"scrypt:{2 ** cost}:8:1"
+
+
+def _hash(password, method):
+    return generate_password_hash(password, method=method)
+
+
+def _verify(stored, password):
+    return check_password_hash(stored, password)
+
+
+def _context():
+    # never fork a threaded gunicorn worker: a lock held by another thread at
+    # fork time stays held in the child. forkserver forks from a clean
+    # single-threaded server; Windows only has spawn.
+    if "forkserver" in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context("forkserver")
+    return multiprocessing.get_context("spawn")
+
+
+class PasswordHasher:
+    """Hash and check passwords in a small process pool.
+
+    A KDF worth using takes tens of milliseconds of CPU; run in the request
+    thread it stalls the worker, and in threads it mostly contends for the
+    GIL. Here each gunicorn worker hands the work to its own pool of
+    `workers` processes. At most `max_pending` hashes may be queued or
+    running; past that, callers wait up to `timeout` seconds and then get
+    HasherBusy, so a login flood backs off instead of piling up.
+
+    Rows still holding a plaintext password are checked directly and
+    reported as needing a rehash, as are hashes made with another cost.
+    """
+
+    def __init__(self, cost=15, workers=2, max_pending=None, timeout=10.0):
+        self.method = _method(cost)
+        self.workers = workers
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(max_pending or workers * 4)
+        self._lock = threading.Lock()
+        self._pool = None
+        self._pid = None
+        # checked against when the account does not exist, so unknown and
+        # known usernames take the same time
+        self._dummy = None
+
+    def _executor(self):
+        # a process pool does not survive a fork, so each worker starts its own
+        with self._lock:
+            if self._pid != os.getpid():
+                self._pool = ProcessPoolExecutor(self.workers, mp_context=_context())
+                self._pid = os.getpid()
+            return self._pool
+
+    def _run(self, fn, *args):
+        if not self._slots.acquire(timeout=self.timeout):
+            raise HasherBusy(f"more than {self.timeout}s waiting for a password hashing slot")
+        try:
+            return self._executor().submit(fn, *args).result()
+        finally:
+            self._slots.release()
+
+    def hash(self, password):
+        return self._run(_hash, password, self.method)
+
+    def verify(self, stored, password):
+        """(matches, needs_rehash) for a stored hash, legacy plaintext or None."""
+        if stored is None:
+            if self._dummy is None:
+                self._dummy = self.hash("")
+            self._run(_verify, self._dummy, password)
+            return False, False
+        if not stored.startswith(HASH_PREFIXES):
+            return hmac.compare_digest(stored.encode(), password.encode()), True
+        if not self._run(_verify, stored, password):
+            return False, False
+        return True, not stored.startswith(self.method + "$")
+
+    def close(self):
+        with self._lock:
+            if self._pool is not None and self._pid == os.getpid():
+                self._pool.shutdown()
+            self._pool = self._pid = None
@@ -0,0 +1,224 @@
+"""Run every SQL statement the apps issue through EXPLAIN QUERY PLAN.
+
+    python query_audit.py
+
+Each app is imported against scratch databases in a temporary directory and
+driven through its routes with the Flask test client while every statement
+it sends to SQLite is recorded together with its parameters. The plans are
+taken with the same statement text and bound parameters the apps used.
+Exits with status 1 if a recorded SELECT/UPDATE/DELETE scans a whole table
+and is not listed in ALLOWED_SCANS, or sorts its rows in a temporary
+B-tree (every matching row, on every request) and is not listed in
+ALLOWED_SORTS.
+"""
+import itertools
+import io
+import re
+import sqlite3
+import sys
+
+import bench_env
+
+# statements that are expected to read a whole table, and why
+ALLOWED_SCANS = {
+    r"SELECT id, title, author FROM books?": "catalog_index loads once per worker",
+    r"SELECT .+ FROM books?": "the dashboards render the whole catalog",
+}
+# statements that are expected to sort their rows in a temporary B-tree, and why
+ALLOWED_SORTS = {}
+LIST_FILTERS = ("gender=Male", "name=ra", "domain=example.com", "phone=555-0100")
+
+
+def trace_engine(module, captured):
+    from sqlalchemy import event
+
+    def record(con, cursor, statement, parameters, context, executemany):
+        if not executemany:
+            captured.append((statement, parameters))
+
+    with module.app.app_context():
+        engine = module.db.engine
+    event.listen(engine, "before_cursor_execute", record)
+    return engine.url.database
+
+
+def trace_pool(pool, captured):
+    class RecordingCursor(sqlite3.Cursor):
+        def execute(self, sql, parameters=()):
+            captured.append((sql, parameters))
+            return super().execute(sql, parameters)
+
+    class RecordingConnection(sqlite3.Connection):
+        def cursor(self, factory=RecordingCursor):
+            return super().cursor(factory)
+
+        def execute(self, sql, parameters=()):
+            return self.cursor().execute(sql, parameters)
+
+    pool.factory = RecordingConnection
+    pool.close()
+
+
+def books_csv():
+    return io.BytesIO(b"title,author,copies\nDune,Frank Herbert,2\nEmma,Jane Austen,1\n")
+
+
+def exercise_app(captured):
+    import app
+
+    database = trace_engine(app, captured)
+    c = app.app.test_client()
+    person = {"name": "Asha Rao", "email": "asha@example.com", "phone": "555-0100", "gender": "Female"}
+    c.post("/", data=person)
+    c.post("/", data=person)
+    c.get("/list")
+    c.get("/list?after=1")
+    c.get("/list?before=2")
+    # every combination of /list filters, in both sort orders and page directions
+    for n in range(len(LIST_FILTERS) + 1):
+        for filters in ("&".join(chosen) for chosen in itertools.combinations(LIST_FILTERS, n)):
+            for sort in ("id", "name"):
+                c.get(f"/list?{filters}&sort={sort}")
+                c.get(f"/list?{filters}&sort={sort}&after=1")
+                c.get(f"/list?{filters}&sort={sort}&before=2")
+                c.get(f"/export.csv?{filters}&sort={sort}").get_data()
+                c.get(f"/export.jsonl?{filters}&sort={sort}").get_data()
+    c.get("/edit/1")
+    c.post("/edit/1", data=person)
+    c.get("/delete/1")
+    return database
+
+
+def exercise_app123(captured):
+    import app123
+
+    database = trace_engine(app123, captured)
+    app123.setup_db()
+    c = app123.app.test_client()
+    c.post("/", data={"username": "admin", "password": "admin123", "role": "admin"})
+    c.post("/add", data={"title": "Dune", "author": "Frank Herbert", "image": ""})
+    c.post("/edit/1", data={"title": "Dune", "author": "Frank Herbert", "image": ""})
+    c.get("/dashboard")
+    c.get("/search?q=frnak+herbrt")
+    c.post("/add", data={"title": "Children of Dune", "author": "Frank Herbert", "image": ""})
+    c.get("/search?q=chidlren+of+dnue")
+    c.post("/admin/import", data={"file": (books_csv(), "books.csv")})
+    c.get("/api/books/suggest?prefix=chi")
+    c.post("/edit/2", data={"title": "Children of Dune", "author": "Frank Herbert", "image": ""})
+    c.get("/api/books/suggest?prefix=frank")
+    c.get("/logout")
+    c.post("/register", data={"username": "student", "password": "pw"})
+    c.post("/", data={"username": "student", "password": "pw", "role": "student"})
+    c.get("/dashboard")
+    c.get("/issue/1")
+    c.get("/return/1")
+    c.get("/search?q=dune")
+    c.get("/search?q=frank+her&page=2")
+    c.get("/issue/1")
+    c.get("/loans")
+    c.get("/loans?before=2")
+    c.get("/logout")
+    c.post("/register", data={"username": "waiting", "password": "pw"})
+    c.post("/", data={"username": "waiting", "password": "pw", "role": "student"})
+    c.get("/hold/1")
+    c.get("/holds")
+    c.get("/logout")
+    c.post("/", data={"username": "student", "password": "pw", "role": "student"})
+    c.get("/return/1")
+    c.get("/hold/1")
+    c.get("/hold/1/cancel")
+    c.get("/logout")
+    c.post("/", data={"username": "admin", "password": "admin123", "role": "admin"})
+    c.get("/loans")
+    c.get("/loans?book=1")
+    c.get("/loans?user=2&before=5")
+    c.get("/delete/1")
+    return database
+
+
+def exercise_library(captured):
+    import library
+
+    trace_pool(library.pool, captured)
+    c = library.app.test_client()
+    for role in ("admin", "student"):
+        c.post("/register", data={"name": role, "email": f"{role}@example.com",
+                                  "password": "pw", "role": role})
+        c.post(f"/login/{role}", data={"email": f"{role}@example.com", "password": "pw"})
+    c.post("/admin", data={"title": "Dune", "author": "Frank Herbert"})
+    c.post("/admin/import", data={"file": (books_csv(), "books.csv")})
+    c.get("/admin")
+    c.get("/student")
+    c.get("/search?q=dune")
+    c.get("/search?q=frank&page=2")
+    return library.app.config["DATABASE"]
+
+
+def template(sql):
+    sql = re.sub(r"'(?:[^']|'')*'", "?", sql)
+    return re.sub(r"\b\d+(\.\d+)?\b", "?", " ".join(sql.split()))
+
+
+def audit(database, statements):
+    con = sqlite3.connect(database)
+    seen = set()
+    failures = 0
+    for sql, parameters in statements:
+        key = template(sql)
+        if key in seen or not key.upper().startswith(("SELECT", "UPDATE", "DELETE", "WITH")):
+            continue
+        if "sqlite_master" in key:
+            continue  # schema introspection by create_all() / Index.create()
+        seen.add(key)
+        plan = [row[3] for row in con.execute("EXPLAIN QUERY PLAN " + sql, parameters)]
+        scans = [step for step in plan if re.fullmatch(r"SCAN \w+", step)]
+        upper = key.upper()
+        # an unfiltered, unsorted LIMIT query stops after LIMIT rows
+        if scans and " LIMIT " in upper and " WHERE " not in upper \
+                and not any("TEMP B-TREE" in step for step in plan):
+            scans = []
+        reason = next((why for pattern, why in ALLOWED_SCANS.items()
+                       if re.fullmatch(pattern, key, re.IGNORECASE)), None)
+        sorts = "USE TEMP B-TREE FOR ORDER BY" in plan
+        sort_reason = next((why for pattern, why in ALLOWED_SORTS.items()
+                            if re.fullmatch(pattern, key, re.IGNORECASE)), None)
+        if scans and reason:
+            status = f"allowed ({reason})"
+        elif scans:
+            status = "FULL SCAN"
+            failures += 1
+        elif sorts and sort_reason:
+            status = f"allowed sort ({sort_reason})"
+        elif sorts:
+            status = "TEMP B-TREE SORT"
+            failures += 1
+        else:
+            status = "ok"
+        print(f"  [{status}] {key}")
+        for step in plan:
+            print(f"      {step}")
+    con.close()
+    return failures
+
+
+def main():
+    bench_env.setup("query_audit")
+
+    failures = 0
+    for name, exercise in (("app.py", exercise_app),
+                           ("app123.py", exercise_app123),
+                           ("library.py", exercise_library)):
+        captured = []
+        database = exercise(captured)
+        print(name)
+        failures += audit(database, captured)
+
+    if failures:
+        print(f"{failures} statement(s) do a full table scan or sort in a temp B-tree")
+        return 1
+    print("no unexpected full table scans or temp B-tree sorts")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
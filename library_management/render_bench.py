@@ -0,0 +1,84 @@
+"""Compare per-render cost of render_template_string() with the compiled template registry.
+
+    python render_bench.py [--renders 2000]
+
+Imports app.py and app123.py against scratch databases and renders their
+pages both ways inside a test request context: "before" passes the inline
+source to render_template_string(), as the views used to, and "after" calls
+render_template() by name, as they do now. It also times compiling every
+template for a fresh worker, without and with JINJA_BYTECODE_CACHE.
+"""
+import argparse
+import os
+import sys
+import time
+from types import SimpleNamespace
+
+import bench_env
+
+
+def per_render(fn, renders):
+    fn()
+    started = time.perf_counter()
+    for _ in range(renders):
+        fn()
+    return (time.perf_counter() - started) * 1000 / renders
+
+
+def pages(app, app123):
+    filters = {"gender": "", "name": "", "domain": "", "phone": "", "sort": "id"}
+    users = [SimpleNamespace(id=i, name=f"User {i}", email=f"user{i}@example.com", phone="5550100",
+                             gender="Female" if i % 2 else "Male") for i in range(50)]
+    books = [SimpleNamespace(id=i, title=f"Title {i}", author="Author", image="", available_copies=1,
+                             total_copies=2) for i in range(100)]
+    return [
+        (app, "add.html", app.ADD_HTML, {}),
+        (app, "list.html", app.LIST_HTML, {"users": users, "size": 50, "filters": filters,
+                                           "prev_cursor": 10, "next_cursor": 60}),
+        (app, "edit.html", app.EDIT_HTML, {"user": users[0]}),
+        (app123, "login.html", app123.LOGIN_HTML, {}),
+        (app123, "register.html", app123.REGISTER_HTML, {}),
+        (app123, "catalog.html", app123.CATALOG_HTML, {"books": books, "role": "student"}),
+    ]
+
+
+def compile_all(module, cache_dir):
+    # what a freshly forked worker pays in template_registry.install()
+    from flask import Flask
+    import template_registry
+    fresh = Flask(module.__name__)
+    fresh.config["JINJA_BYTECODE_CACHE"] = cache_dir
+    sources = dict(module.app.jinja_loader.mapping)
+    started = time.perf_counter()
+    template_registry.install(fresh, sources)
+    return (time.perf_counter() - started) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--renders", type=int, default=2000, help="renders per page and method")
+    args = parser.parse_args()
+
+    workdir = bench_env.setup("render_bench")
+
+    import app
+    import app123
+    from flask import render_template, render_template_string
+
+    print("page            before ms   after ms   speedup")
+    for module, name, source, context in pages(app, app123):
+        with module.app.test_request_context("/"):
+            before = per_render(lambda: render_template_string(source, **context), args.renders)
+            after = per_render(lambda: render_template(name, **context), args.renders)
+        print(f"{name:<14}  {before:9.3f}  {after:9.3f}  {before / after:7.1f}x")
+
+    cache_dir = os.path.join(workdir, "jinja_cache")
+    print("\nworker startup, all templates    app.py ms   app123.py ms")
+    for label, directory in (("compile from source", None), ("bytecode cache, cold", cache_dir),
+                             ("bytecode cache, warm", cache_dir)):
+        print(f"{label:<32}  {compile_all(app, directory):9.2f}  {compile_all(app123, directory):12.2f}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
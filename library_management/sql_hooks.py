@@ -0,0 +1,132 @@
+import sqlite3
+import time
+
+
+class QueryHooks:
+    """Call listeners with (statement, parameters, seconds) for every SQL statement.
+
+    One object per app. connection_factory is a sqlite3.Connection subclass
+    whose cursors time each statement from execute() until its last row is
+    fetched; pass it to code that opens raw connections (dbpool's factory=
+    argument), and instrument_engine() makes a SQLAlchemy engine open its
+    connections with it. Listeners run in the thread that issued the
+    statement, so they can use flask.g.
+    """
+
+    def __init__(self):
+        self.listeners = []
+        hooks = self
+
+        class TimedCursor(sqlite3.Cursor):
+            # SQLite does most of a query's work while its rows are stepped
+            # through, so a statement is reported once, with the time spent
+            # executing it and fetching its rows, when the rows run out or
+            # the cursor executes again, is closed or is dropped
+            _pending = None
+
+            def _report(self):
+                pending, self._pending = self._pending, None
+                if pending is not None:
+                    hooks.notify(*pending)
+
+            def _fetched(self, started, done):
+                if self._pending is not None:
+                    self._pending[2] += time.perf_counter() - started
+                    if done:
+                        self._report()
+
+            def execute(self, sql, parameters=()):
+                self._report()
+                started = time.perf_counter()
+                try:
+                    super().execute(sql, parameters)
+                except BaseException:
+                    hooks.notify(sql, parameters, time.perf_counter() - started)
+                    raise
+                self._pending = [sql, parameters, time.perf_counter() - started]
+                if self.description is None:
+                    self._report()  # no rows to fetch
+                return self
+
+            def executemany(self, sql, seq_of_parameters):
+                self._report()
+                started = time.perf_counter()
+                try:
+                    return super().executemany(sql, seq_of_parameters)
+                finally:
+                    hooks.notify(sql, None, time.perf_counter() - started)
+
+            def fetchone(self):
+                started = time.perf_counter()
+                row = super().fetchone()
+                self._fetched(started, row is None)
+                return row
+
+            def fetchmany(self, size=None):
+                size = self.arraysize if size is None else size
+                started = time.perf_counter()
+                rows = super().fetchmany(size)
+                self._fetched(started, len(rows) < size)
+                return rows
+
+            def fetchall(self):
+                started = time.perf_counter()
+                rows = super().fetchall()
+                self._fetched(started, True)
+                return rows
+
+            def __iter__(self):
+                # timed batches, not a timed call per row
+                while True:
+                    rows = self.fetchmany(256)
+                    yield from rows
+                    if len(rows) < 256:
+                        return
+
+            def __next__(self):
+                started = time.perf_counter()
+                try:
+                    row = super().__next__()
+                except StopIteration:
+                    self._fetched(started, True)
+                    raise
+                self._fetched(started, False)
+                return row
+
+            def close(self):
+                self._report()
+                super().close()
+
+            def __del__(self):
+                self._report()
+
+        class TimedConnection(sqlite3.Connection):
+            def cursor(self, factory=TimedCursor):
+                return super().cursor(factory)
+
+            def execute(self, sql, parameters=()):
+                return self.cursor().execute(sql, parameters)
+
+            def executemany(self, sql, seq_of_parameters):
+                return self.cursor().executemany(sql, seq_of_parameters)
+
+        self.connection_factory = TimedConnection
+
+    def subscribe(self, listener):
+        self.listeners.append(listener)
+
+    def notify(self, statement, parameters, seconds):
+        for listener in self.listeners:
+            listener(statement, parameters, seconds)
+
+    def instrument_engine(self, engine):
+        """Open the engine's sqlite3 connections with connection_factory.
+
+        Call it before the engine first connects: connections already in
+        its pool are not timed.
+        """
+        from sqlalchemy import event
+
+        @event.listens_for(engine, "do_connect")
+        def _connect(dialect, record, cargs, cparams):
+            cparams["factory"] = self.connection_factory
@@ -0,0 +1,134 @@
+import os
+from contextlib import contextmanager
+
+# Connection-level PRAGMAs applied to every SQLite connection the apps open,
+# whether it comes from a SQLAlchemy engine or from a raw sqlite3 pool.
+# Pick one with the SQLITE_PROFILE setting.
+PROFILES = {
+    # WAL lets readers run alongside the single writer; synchronous=NORMAL is
+    # crash-safe in WAL mode and only risks the last commits on power loss
+    "throughput": {
+        "journal_mode": "wal",
+        "synchronous": "normal",
+        "busy_timeout": 5000,
+        "cache_size": -65536,
+        "mmap_size": 268435456,
+        "temp_store": "memory",
+    },
+    "durable": {
+        "journal_mode": "wal",
+        "synchronous": "full",
+        "busy_timeout": 10000,
+        "cache_size": -16384,
+    },
+    # requests cannot write; startup schema work goes through writable() or
+    # schema_setup(), which lift query_only for its duration
+    "readonly": {
+        "query_only": 1,
+        "busy_timeout": 5000,
+        "cache_size": -65536,
+        "mmap_size": 268435456,
+    },
+    "none": {},
+}
+
+_SYNCHRONOUS = {"off": 0, "normal": 1, "full": 2, "extra": 3}
+_TEMP_STORE = {"default": 0, "file": 1, "memory": 2}
+
+# engines inside schema_setup(); their connections may write whatever the profile
+_schema_engines = set()
+
+
+def get_profile(name):
+    try:
+        return PROFILES[name]
+    except KeyError:
+        raise ValueError(f"unknown SQLite profile {name!r}, expected one of {sorted(PROFILES)}")
+
+
+def read_only(name):
+    """True if the profile keeps request connections from writing."""
+    return bool(get_profile(name).get("query_only"))
+
+
+def apply_profile(con, name):
+    for key, value in get_profile(name).items():
+        con.execute(f"PRAGMA {key}={value}")
+
+
+def _expected(key, value):
+    if key == "synchronous":
+        return _SYNCHRONOUS[value]
+    if key == "temp_store":
+        return _TEMP_STORE[value]
+    return value
+
+
+def verify_profile(con, name):
+    """Read every PRAGMA back and raise if SQLite did not accept it."""
+    wrong = {}
+    for key, value in get_profile(name).items():
+        actual = con.execute(f"PRAGMA {key}").fetchone()[0]
+        if isinstance(actual, str):
+            actual = actual.lower()
+        if key == "journal_mode" and actual == "memory":
+            continue  # in-memory databases cannot use WAL
+        if actual != _expected(key, value):
+            wrong[key] = (value, actual)
+    if wrong:
+        raise RuntimeError(f"SQLite profile {name!r} not applied: {wrong}")
+
+
+@contextmanager
+def writable(con):
+    """Let one raw connection write for the duration of the block (startup DDL)."""
+    blocked = con.execute("PRAGMA query_only").fetchone()[0]
+    con.execute("PRAGMA query_only=0")
+    try:
+        yield con
+    finally:
+        con.execute(f"PRAGMA query_only={blocked}")
+
+
+@contextmanager
+def schema_setup(engine):
+    """Let every connection the engine hands out in the block write (DDL, seed rows).
+
+    Meant for startup, before requests are served: while it is open,
+    connections checked out by other threads may write too.
+    """
+    _schema_engines.add(engine)
+    try:
+        yield
+    finally:
+        _schema_engines.discard(engine)
+
+
+def install(engine, name):
+    """Apply the profile to every connection of a SQLAlchemy engine and check it once."""
+    from sqlalchemy import event, exc
+
+    profile = get_profile(name)
+
+    @event.listens_for(engine, "connect")
+    def _on_connect(dbapi_con, record):
+        record.info["pid"] = os.getpid()
+        apply_profile(dbapi_con, name)
+
+    @event.listens_for(engine, "checkout")
+    def _check_pid(dbapi_con, record, proxy):
+        # a connection pooled before a fork (gunicorn --preload) belongs to
+        # the parent: drop it without closing the parent's handle
+        if record.info["pid"] != os.getpid():
+            record.dbapi_connection = proxy.dbapi_connection = None
+            raise exc.DisconnectionError("connection was opened by another process")
+
+    if profile.get("query_only"):
+        @event.listens_for(engine, "checkout")
+        def _on_checkout(dbapi_con, record, proxy):
+            dbapi_con.execute(f"PRAGMA query_only={0 if engine in _schema_engines else 1}")
+
+    with engine.connect() as con:
+        verify_profile(con.connection.dbapi_connection, name)
+    # the check runs at import; leave the pool empty for the workers
+    engine.dispose()
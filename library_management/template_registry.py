@@ -0,0 +1,22 @@
+import os
+
+from jinja2 import DictLoader, FileSystemBytecodeCache
+
+
+def install(app, templates):
+    """Serve the apps' inline page sources by name and compile them all up front.
+
+    render_template_string() parses and compiles its source on every call;
+    templates loaded by name are compiled once and kept in the Jinja
+    environment's cache. Setting JINJA_BYTECODE_CACHE to a directory also
+    stores the compiled bytecode on disk so freshly forked workers skip the
+    compile step entirely.
+    """
+    cache_dir = app.config.get("JINJA_BYTECODE_CACHE")
+    if cache_dir:
+        os.makedirs(cache_dir, exist_ok=True)
+        app.jinja_options = dict(app.jinja_options,
+                                 bytecode_cache=FileSystemBytecodeCache(cache_dir))
+    app.jinja_loader = DictLoader(templates)
+    for name in templates:
+        app.jinja_env.get_template(name)
@@ -0,0 +1,98 @@
+"""Check that Server-Timing's phases account for a large catalog page.
+
+    python timing_bench.py [--books 100000] [--requests 5] [--min-share 0.8]
+
+Imports library.py and app123.py with SERVER_TIMING=1 against scratch
+databases holding --books books, and requests each app's student catalog
+(library.py's /student, app123's /dashboard) with the catalog cache
+cleared, so every request reads and renders the whole table. Prints the
+median db, render and session durations from the Server-Timing header and
+the share of total they cover, and exits 1 if that share is below
+--min-share for either page: time that lands in no phase means the header
+is not telling where the request went.
+"""
+import argparse
+import os
+import re
+import sqlite3
+import statistics
+import sys
+
+import bench_env
+
+PHASES = ("db", "render", "session", "total")
+
+
+def durations(header):
+    return {name: float(ms) for name, ms in re.findall(r"(\w+);dur=([\d.]+)", header)}
+
+
+def measure(client, url, bump, requests):
+    samples = []
+    for _ in range(requests):
+        bump()
+        response = client.get(url)
+        assert response.status_code == 200, (url, response.status_code)
+        samples.append(durations(response.headers["Server-Timing"]))
+    return {name: statistics.median(s[name] for s in samples) for name in PHASES}
+
+
+def fill(database, table, books, extra_columns):
+    con = sqlite3.connect(database)
+    with con:
+        con.executemany(
+            f"INSERT INTO {table} (title, author, available_copies, total_copies{extra_columns[0]}) "
+            f"VALUES (?, ?, 1, 2{extra_columns[1]})",
+            ((f"Title {i}", f"Author {i % 997}") for i in range(books)))
+    con.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--books", type=int, default=100000, help="books in each catalog")
+    parser.add_argument("--requests", type=int, default=5, help="timed requests per page")
+    parser.add_argument("--min-share", type=float, default=0.8,
+                        help="least share of total that db + render + session must cover")
+    args = parser.parse_args()
+
+    workdir = bench_env.setup("timing_bench", SERVER_TIMING=1, PASSWORD_HASH_COST=10)
+
+    import logging
+    import app123
+    import library
+
+    # every read of the whole catalog is a slow query
+    logging.getLogger("sql").setLevel(logging.ERROR)
+
+    library.init_db()
+    fill(os.environ["LIBRARY_DB"], "books", args.books, ("", ""))
+    app123.setup_db()
+    fill(os.path.join(workdir, "app123.db"), "book", args.books, (", image", ", ''"))
+
+    pages = []
+    client = library.app.test_client()
+    with client.session_transaction() as s:
+        s["student"] = "student@example.com"
+    pages.append(("library.py /student", measure(client, "/student", library.catalog_cache.bump, args.requests)))
+    client = app123.app.test_client()
+    with client.session_transaction() as s:
+        s["user"], s["role"] = "student", "student"
+    pages.append(("app123.py /dashboard",
+                  measure(client, "/dashboard", app123.catalog_cache.bump, args.requests)))
+
+    print(f"{args.books} books, median of {args.requests} requests")
+    print("page                     db ms   render ms  session ms    total ms  covered")
+    failed = False
+    for name, ms in pages:
+        share = (ms["db"] + ms["render"] + ms["session"]) / ms["total"]
+        failed |= share < args.min_share
+        print(f"{name:<22} {ms['db']:8.1f}  {ms['render']:10.1f}  {ms['session']:10.2f}  "
+              f"{ms['total']:10.1f}  {share:6.0%}")
+    if failed:
+        print(f"FAIL: phases cover less than {args.min_share:.0%} of total")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,343 @@
+import bisect
+import glob
+import json
+import os
+import threading
+import time
+import uuid
+import weakref
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    import ctypes
+    import msvcrt
+    fcntl = None
+
+from flask import current_app, g, has_request_context, request
+
+# upper bounds, in seconds, of the request latency and DB time histogram buckets
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class _Shard:
+    # one thread's counters; only that thread writes to it
+    def __init__(self, thread=None):
+        self.pid = os.getpid()
+        self.thread = thread  # weakref to the owner; None for exited threads' totals
+        self.latency = {}    # endpoint -> per-bucket counts, +Inf, then the sum
+        self.db = {}         # endpoint -> the same, for time spent in SQL
+        self.queries = {}    # endpoint -> SQL statements run
+        self.requests = {}   # (endpoint, method, status) -> count
+        self.in_flight = {}  # endpoint -> requests started minus finished
+
+
+def _observe(histograms, endpoint, value):
+    counts = histograms.get(endpoint)
+    if counts is None:
+        counts = histograms[endpoint] = [0] * (len(LATENCY_BUCKETS) + 1) + [0.0]
+    counts[bisect.bisect_left(LATENCY_BUCKETS, value)] += 1
+    counts[-1] += value
+
+
+def _add_histograms(total, histograms):
+    for endpoint, counts in histograms.items():
+        into = total.setdefault(endpoint, [0] * len(counts))
+        for i, value in enumerate(counts):
+            into[i] += value
+
+
+def _merge(total, snapshot, live=True):
+    _add_histograms(total["latency"], snapshot["latency"])
+    _add_histograms(total["db"], snapshot["db"])
+    for endpoint, count in snapshot.get("queries", {}).items():
+        total["queries"][endpoint] = total["queries"].get(endpoint, 0) + count
+    for endpoint, method, status, count in snapshot["requests"]:
+        key = (endpoint, method, status)
+        total["requests"][key] = total["requests"].get(key, 0) + count
+    if live:
+        for endpoint, count in snapshot["in_flight"].items():
+            total["in_flight"][endpoint] = total["in_flight"].get(endpoint, 0) + count
+
+
+def _fold(into, shard):
+    # add an exited thread's counters to the retired shard
+    _add_histograms(into.latency, shard.latency)
+    _add_histograms(into.db, shard.db)
+    for name in ("queries", "requests", "in_flight"):
+        counts = getattr(into, name)
+        for key, n in getattr(shard, name).items():
+            counts[key] = counts.get(key, 0) + n
+
+
+def _empty():
+    return {"latency": {}, "db": {}, "queries": {}, "requests": {}, "in_flight": {}}
+
+
+def _frozen(total):
+    # JSON form: request counts as a list, since keys cannot be tuples
+    return dict(total, requests=[(*key, n) for key, n in total["requests"].items()])
+
+
+@contextmanager
+def _exclusive(path):
+    # held until the block ends; the lock file itself stays empty
+    with open(path, "a") as f:
+        if fcntl is not None:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            yield
+            return
+        f.seek(0)
+        while True:
+            try:
+                # LK_LOCK retries for about 10 seconds, then raises
+                msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+                break
+            except OSError:
+                continue
+        try:
+            yield
+        finally:
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+def _alive(pid):
+    if fcntl is None:
+        # os.kill(pid, 0) would terminate the process on Windows
+        kernel32 = ctypes.WinDLL("kernel32", use_last_error=True)
+        handle = kernel32.OpenProcess(0x1000, False, pid)  # PROCESS_QUERY_LIMITED_INFORMATION
+        if not handle:
+            return ctypes.get_last_error() == 5  # ERROR_ACCESS_DENIED: exists, not ours
+        try:
+            code = ctypes.c_ulong()
+            return not kernel32.GetExitCodeProcess(handle, ctypes.byref(code)) or code.value == 259  # STILL_ACTIVE
+        finally:
+            kernel32.CloseHandle(handle)
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class Metrics:
+    """Per-endpoint request metrics for every worker of a gunicorn master.
+
+    Each request thread counts into its own shard, so recording takes no
+    lock; shards of exited threads are folded into one, so thread-per-request
+    servers do not grow the list. About once per `flush_interval` seconds a worker sums its shards
+    and replaces its snapshot file in `directory`; GET /metrics sums every
+    worker's snapshot into one Prometheus text page, so any worker can
+    answer the scrape for the whole master. In-flight gauges of other
+    workers are up to `flush_interval` old, and those of dead workers are
+    dropped while their counters are folded into an archive file, so
+    totals survive worker restarts. Clear the directory to start from zero.
+
+    Without a directory each process reports only itself. DB time is fed
+    in by QueryHooks through record_query.
+    """
+
+    def __init__(self, name, directory=None, flush_interval=1.0):
+        self.name = name
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self.app = None
+        self._local = threading.local()
+        self._shards = []
+        self._lock = threading.Lock()
+        self._flushing = threading.Lock()
+        self._next_flush = 0.0
+        self._path = None
+        self._path_pid = None
+
+    def _shard(self):
+        shard = getattr(self._local, "shard", None)
+        if shard is None or shard.pid != os.getpid():
+            shard = self._local.shard = _Shard(weakref.ref(threading.current_thread()))
+            with self._lock:
+                self._shards = self._pruned(shard.pid)
+                self._shards.append(shard)
+        return shard
+
+    def _pruned(self, pid):
+        # shards inherited across a fork belong to the parent, and those of
+        # exited threads are folded into one retired shard, so a
+        # thread-per-request server keeps one shard per live thread
+        live, dead, retired = [], [], None
+        for shard in self._shards:
+            if shard.pid != pid:
+                continue
+            if shard.thread is None:
+                retired = shard
+                continue
+            thread = shard.thread()
+            (live if thread is not None and thread.is_alive() else dead).append(shard)
+        if dead:
+            retired = retired or _Shard()
+            for shard in dead:
+                _fold(retired, shard)
+        if retired is not None:
+            live.append(retired)
+        return live
+
+    # ---- recording ----
+
+    def _started(self):
+        endpoint = request.endpoint or "none"
+        g.metrics = {"endpoint": endpoint, "started": time.perf_counter(), "db": 0.0,
+                     "queries": 0, "status": 500}
+        shard = self._shard()
+        shard.in_flight[endpoint] = shard.in_flight.get(endpoint, 0) + 1
+
+    def _responded(self, response):
+        state = g.get("metrics")
+        if state is not None:
+            state["status"] = response.status_code
+        return response
+
+    def _finished(self, exc):
+        state = g.pop("metrics", None)
+        if state is None:
+            return
+        endpoint = state["endpoint"]
+        shard = self._shard()
+        _observe(shard.latency, endpoint, time.perf_counter() - state["started"])
+        _observe(shard.db, endpoint, state["db"])
+        shard.queries[endpoint] = shard.queries.get(endpoint, 0) + state["queries"]
+        key = (endpoint, request.method, state["status"])
+        shard.requests[key] = shard.requests.get(key, 0) + 1
+        shard.in_flight[endpoint] = shard.in_flight.get(endpoint, 0) - 1
+        if self.directory and time.monotonic() >= self._next_flush:
+            self.flush()
+
+    def record_query(self, statement, parameters, seconds):
+        if has_request_context() and current_app._get_current_object() is self.app:
+            state = g.get("metrics")
+            if state is not None:
+                state["db"] += seconds
+                state["queries"] += 1
+
+    # ---- aggregation ----
+
+    def snapshot(self):
+        """This process's totals over all of its threads."""
+        total = _empty()
+        pid = os.getpid()
+        with self._lock:
+            # under the lock, so a shard being retired is counted exactly once
+            for shard in self._shards:
+                if shard.pid != pid:
+                    continue
+                # copies of builtin dicts and lists are atomic under the GIL
+                _merge(total, {
+                    "latency": {e: list(c) for e, c in dict(shard.latency).items()},
+                    "db": {e: list(c) for e, c in dict(shard.db).items()},
+                    "queries": dict(shard.queries),
+                    "requests": [(*key, n) for key, n in dict(shard.requests).items()],
+                    "in_flight": dict(shard.in_flight),
+                })
+        return _frozen(total)
+
+    def flush(self):
+        """Replace this worker's snapshot file (no-op if another thread is at it)."""
+        if not self._flushing.acquire(blocking=False):
+            return
+        try:
+            self._next_flush = time.monotonic() + self.flush_interval
+            pid = os.getpid()
+            if self._path_pid != pid:
+                os.makedirs(self.directory, exist_ok=True)
+                # the token keeps a recycled pid from overwriting a dead worker's file
+                self._path = os.path.join(self.directory, f"{self.name}-{pid}-{uuid.uuid4().hex[:8]}.json")
+                self._path_pid = pid
+            tmp = self._path + ".tmp"
+            with open(tmp, "w") as f:
+                json.dump(self.snapshot(), f)
+            os.replace(tmp, self._path)
+        finally:
+            self._flushing.release()
+
+    def collect(self):
+        """Totals over every worker sharing the directory."""
+        total = _empty()
+        if not self.directory:
+            _merge(total, self.snapshot())
+            return total
+        self.flush()
+        archive_path = os.path.join(self.directory, f"{self.name}-archive.json")
+        # one scraper at a time, so a dead worker is archived exactly once
+        with _exclusive(os.path.join(self.directory, f"{self.name}.lock")):
+            archive = _empty()
+            if os.path.exists(archive_path):
+                with open(archive_path) as f:
+                    _merge(archive, json.load(f), live=False)
+            dead = []
+            for path in glob.glob(os.path.join(self.directory, f"{self.name}-[0-9]*.json")):
+                pid = int(os.path.basename(path)[len(self.name) + 1:].split("-")[0])
+                try:
+                    with open(path) as f:
+                        snapshot = json.load(f)
+                except (OSError, ValueError):
+                    continue
+                if _alive(pid):
+                    _merge(total, snapshot)
+                else:
+                    _merge(archive, snapshot, live=False)
+                    dead.append(path)
+            if dead:
+                with open(archive_path + ".tmp", "w") as f:
+                    json.dump(_frozen(archive), f)
+                os.replace(archive_path + ".tmp", archive_path)
+                for path in dead:
+                    os.unlink(path)
+        _merge(total, _frozen(archive), live=False)
+        return total
+
+    def render(self):
+        total = self.collect()
+        app = _label(self.name)
+        lines = []
+        for metric, key, help in (
+                ("http_request_duration_seconds", "latency", "Request latency by endpoint."),
+                ("http_request_db_seconds", "db", "Time spent in SQL per request, by endpoint.")):
+            lines.append(f"# HELP {metric} {help}")
+            lines.append(f"# TYPE {metric} histogram")
+            for endpoint, counts in sorted(total[key].items()):
+                labels = f'app="{app}",endpoint="{_label(endpoint)}"'
+                cumulative = 0
+                for bound, count in zip(LATENCY_BUCKETS + ("+Inf",), counts):
+                    cumulative += count
+                    lines.append(f'{metric}_bucket{{{labels},le="{bound}"}} {cumulative}')
+                lines.append(f"{metric}_sum{{{labels}}} {counts[-1]:.6f}")
+                lines.append(f"{metric}_count{{{labels}}} {cumulative}")
+        lines.append("# HELP http_request_queries_total SQL statements run by requests, by endpoint.")
+        lines.append("# TYPE http_request_queries_total counter")
+        for endpoint, count in sorted(total["queries"].items()):
+            lines.append(f'http_request_queries_total{{app="{app}",endpoint="{_label(endpoint)}"}} {count}')
+        lines.append("# HELP http_requests_total Finished requests by endpoint, method and status.")
+        lines.append("# TYPE http_requests_total counter")
+        for (endpoint, method, status), count in sorted(total["requests"].items()):
+            lines.append(f'http_requests_total{{app="{app}",endpoint="{_label(endpoint)}",'
+                         f'method="{_label(method)}",status="{status}"}} {count}')
+        lines.append("# HELP http_requests_in_flight Requests being served, by endpoint.")
+        lines.append("# TYPE http_requests_in_flight gauge")
+        for endpoint, count in sorted(total["in_flight"].items()):
+            lines.append(f'http_requests_in_flight{{app="{app}",endpoint="{_label(endpoint)}"}} {count}')
+        return "\n".join(lines) + "\n"
+
+    def init_app(self, app, path="/metrics"):
+        self.app = app
+        # first in line, so throttled and short-circuited requests are timed too
+        app.before_request_funcs.setdefault(None, []).insert(0, self._started)
+        app.after_request(self._responded)
+        app.teardown_request(self._finished)
+        app.add_url_rule(path, "metrics", lambda: app.response_class(
+            self.render(), mimetype="text/plain; version=0.0.4"))
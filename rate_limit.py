@@ -0,0 +1,111 @@
+import os
+import sqlite3
+import threading
+import time
+
+from flask import request
+
+# One check is a single UPSERT: a new key starts with a full bucket less the
+# token it spends, an existing one is refilled for the time since its last
+# hit and spends a token only if that leaves at least one. No row comes back
+# when the bucket is empty.
+SPEND = """
+INSERT INTO buckets (key, tokens, updated) VALUES (:key, :capacity - 1, :now)
+ON CONFLICT (key) DO UPDATE SET
+    tokens = min(:capacity, tokens + (:now - updated) * :rate) - 1,
+    updated = :now
+WHERE min(:capacity, tokens + (:now - updated) * :rate) >= 1
+RETURNING tokens
+"""
+
+
+def parse_rule(rule):
+    """Parse "20/60" to (20, 60.0): bursts of up to 20, refilled at 20 per 60 seconds."""
+    count, _, seconds = rule.partition("/")
+    return int(count), float(seconds or 60)
+
+
+class RateLimiter:
+    """Per-IP and per-account token buckets shared by every worker on the host.
+
+    The buckets live in their own small SQLite file, not in the app's
+    database, so a throttled request is answered with 429 before anything
+    touches the app's tables or write lock. Each key costs one row; rows
+    idle for longer than the refill period are equivalent to a full bucket
+    and are deleted every `sweep_every` checks.
+
+    Views opt in with @limiter.limit(account=...), where account returns the
+    login or email being tried (read from the form, not the database).
+
+    The IP bucket is keyed on request.remote_addr. Behind a reverse proxy
+    that is the proxy's address and every client would share one bucket,
+    so the apps wrap themselves in werkzeug's ProxyFix when TRUSTED_PROXIES
+    is set; it must be the number of proxies that append to
+    X-Forwarded-For, since a client can forge anything to the left of them.
+    """
+
+    def __init__(self, path, ip_rule="20/60", account_rule="5/60", methods=("POST",), sweep_every=1000):
+        self.path = path
+        self.rules = {"ip": parse_rule(ip_rule), "account": parse_rule(account_rule)}
+        self.methods = methods
+        self.sweep_every = sweep_every
+        self._local = threading.local()
+        self._checks = 0
+
+    def _connect(self):
+        local = self._local
+        if getattr(local, "pid", None) != os.getpid():
+            con = sqlite3.connect(self.path, isolation_level=None, timeout=5)
+            # throwaway state: losing it on a crash only forgives some clients
+            con.execute("PRAGMA journal_mode=WAL")
+            con.execute("PRAGMA synchronous=OFF")
+            con.execute("CREATE TABLE IF NOT EXISTS buckets "
+                        "(key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL) WITHOUT ROWID")
+            con.execute("CREATE INDEX IF NOT EXISTS ix_buckets_updated ON buckets (updated)")
+            local.con, local.pid = con, os.getpid()
+        return local.con
+
+    def hit(self, key, rule):
+        """Spend a token from key's bucket; 0 if allowed, else seconds until one is free."""
+        capacity, period = self.rules[rule]
+        rate = capacity / period
+        con = self._connect()
+        now = time.time()
+        row = con.execute(SPEND, {"key": key, "capacity": capacity, "rate": rate, "now": now}).fetchone()
+        self._checks += 1
+        if self._checks % self.sweep_every == 0:
+            longest = max(period for _, period in self.rules.values())
+            con.execute("DELETE FROM buckets WHERE updated < ?", (now - longest,))
+        if row is not None:
+            return 0
+        row = con.execute("SELECT tokens, updated FROM buckets WHERE key = ?", (key,)).fetchone()
+        tokens = min(capacity, row[0] + (now - row[1]) * rate) if row else capacity
+        return max(0.0, (1 - tokens) / rate)
+
+    def limit(self, account=None):
+        def decorate(view):
+            view.rate_limit_account = account or (lambda: None)
+            return view
+        return decorate
+
+    def check(self, app):
+        """429 response if the current request is over a limit, else None."""
+        view = app.view_functions.get(request.endpoint)
+        account = getattr(view, "rate_limit_account", None)
+        if account is None or request.method not in self.methods:
+            return None
+        keys = [(f"{request.endpoint}:ip:{request.remote_addr}", "ip")]
+        name = account()
+        if name:
+            keys.append((f"{request.endpoint}:account:{name.strip().lower()}", "account"))
+        for key, rule in keys:
+            wait = self.hit(key, rule)
+            if wait:
+                retry = max(1, int(wait + 0.999))
+                return app.response_class("Too many attempts, please wait and try again.", 429,
+                                          {"Retry-After": str(retry)})
+        return None
+
+    def init_app(self, app):
+        # first in line, ahead of hooks that read the app's database
+        app.before_request_funcs.setdefault(None, []).insert(0, lambda: self.check(app))
@@ -0,0 +1,126 @@
+import time
+
+from flask import has_request_context, request
+from flask.signals import before_render_template, template_rendered
+
+ENVIRON_KEY = "server_timing"
+
+
+class _Phase:
+    __slots__ = ("state", "name", "started")
+
+    def __init__(self, state, name):
+        self.state = state
+        self.name = name
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+
+    def __exit__(self, *exc):
+        self.state[self.name] = self.state.get(self.name, 0.0) + time.perf_counter() - self.started
+
+
+class _Null:
+    def __enter__(self):
+        pass
+
+    def __exit__(self, *exc):
+        pass
+
+
+_NULL = _Null()
+
+
+class _TimedSessions:
+    # wraps the app's session interface; everything but open/save passes through
+    def __init__(self, inner, timing):
+        self.inner = inner
+        self.timing = timing
+
+    def __getattr__(self, name):
+        return getattr(self.inner, name)
+
+    def is_null_session(self, session):
+        return self.inner.is_null_session(session)
+
+    def make_null_session(self, app):
+        return self.inner.make_null_session(app)
+
+    def open_session(self, app, request):
+        with self.timing.phase("session"):
+            return self.inner.open_session(app, request)
+
+    def save_session(self, app, session, response):
+        with self.timing.phase("session"):
+            return self.inner.save_session(app, session, response)
+
+
+class ServerTiming:
+    """Server-Timing response header: db, render, session and total, in ms.
+
+    A WSGI wrapper starts the clock and adds the header in start_response,
+    after Flask has saved the session, so every phase is in. SQL time comes
+    from QueryHooks, Jinja render time from Flask's template signals, and
+    pages built in Python can time themselves with `with timing.phase("render")`.
+    The numbers tell any client how long the server spent on what, so the
+    header is opt-in; until init_app runs, phase() is a no-op.
+    """
+
+    def __init__(self):
+        self.app = None
+
+    def phase(self, name):
+        if self.app is None or not has_request_context():
+            return _NULL
+        state = request.environ.get(ENVIRON_KEY)
+        return _NULL if state is None else _Phase(state, name)
+
+    def record_query(self, statement, parameters, seconds):
+        if has_request_context():
+            state = request.environ.get(ENVIRON_KEY)
+            if state is not None:
+                state["db"] += seconds
+                state["queries"] += 1
+
+    def _render_started(self, sender, template, context, **extra):
+        state = request.environ.get(ENVIRON_KEY)
+        if state is not None:
+            # count nested renders once
+            state["depth"] += 1
+            if state["depth"] == 1:
+                state["render_started"] = time.perf_counter()
+
+    def _render_finished(self, sender, template, context, **extra):
+        state = request.environ.get(ENVIRON_KEY)
+        if state is not None and state["depth"]:
+            state["depth"] -= 1
+            if state["depth"] == 0:
+                state["render"] += time.perf_counter() - state["render_started"]
+
+    @staticmethod
+    def header(state, total):
+        return (f'db;dur={state["db"] * 1000:.2f};desc="{state["queries"]} queries", '
+                f'render;dur={state["render"] * 1000:.2f}, '
+                f'session;dur={state["session"] * 1000:.2f}, '
+                f"total;dur={total * 1000:.2f}")
+
+    def _wrap(self, wsgi_app):
+        def timed_app(environ, start_response):
+            started = time.perf_counter()
+            state = environ[ENVIRON_KEY] = {"db": 0.0, "queries": 0, "render": 0.0,
+                                            "session": 0.0, "depth": 0}
+
+            def timed_start_response(status, headers, exc_info=None):
+                headers.append(("Server-Timing", self.header(state, time.perf_counter() - started)))
+                return start_response(status, headers, exc_info)
+
+            return wsgi_app(environ, timed_start_response)
+        return timed_app
+
+    def init_app(self, app, query_hooks):
+        self.app = app
+        query_hooks.subscribe(self.record_query)
+        before_render_template.connect(self._render_started, app)
+        template_rendered.connect(self._render_finished, app)
+        app.session_interface = _TimedSessions(app.session_interface, self)
+        app.wsgi_app = self._wrap(app.wsgi_app)
@@ -0,0 +1,79 @@
+import functools
+import logging
+import re
+
+from flask import current_app, g, has_request_context, request
+
+log = logging.getLogger("sql")
+
+_LITERAL = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_IN_LIST = re.compile(r"\(\s*\?(?:\s*,\s*\?)*\s*\)")
+
+
+@functools.lru_cache(maxsize=1024)
+def template(statement):
+    """Statement with literals as ? and IN lists folded, for grouping repeats."""
+    sql = _LITERAL.sub("?", " ".join(statement.split()))
+    return _IN_LIST.sub("(?...)", sql)
+
+
+def shape(parameters):
+    """Types of the bound parameters, never their values: "(str, int x3)"."""
+    if parameters is None:
+        return "(executemany)"
+    if isinstance(parameters, dict):
+        return "{" + ", ".join(f"{k}: {type(v).__name__}" for k, v in parameters.items()) + "}"
+    runs = []
+    for value in parameters:
+        name = type(value).__name__
+        if runs and runs[-1][0] == name:
+            runs[-1][1] += 1
+        else:
+            runs.append([name, 1])
+    return "(" + ", ".join(name if n == 1 else f"{name} x{n}" for name, n in runs) + ")"
+
+
+class QueryTracer:
+    """Per-request SQL accounting on top of QueryHooks.
+
+    Counts and times the statements each request runs, logs any statement
+    slower than slow_ms with the shape of its parameters (values stay out
+    of the log), and when a request ends, warns about every statement
+    template that ran more than repeat_limit times in it, the usual sign of
+    a query issued once per row (N+1). A DEBUG line per request gives the
+    totals.
+    """
+
+    def __init__(self, slow_ms=100.0, repeat_limit=10):
+        self.slow = slow_ms / 1000
+        self.repeat_limit = repeat_limit
+        self.app = None
+
+    def record_query(self, statement, parameters, seconds):
+        if seconds >= self.slow:
+            where = f" in {request.method} {request.path}" if has_request_context() else ""
+            log.warning("slow query (%.1f ms)%s: %s params=%s", seconds * 1000, where,
+                        " ".join(statement.split()), shape(parameters))
+        if not (has_request_context() and current_app._get_current_object() is self.app):
+            return
+        state = g.get("sql_trace")
+        if state is None:
+            state = g.sql_trace = {"queries": 0, "seconds": 0.0, "templates": {}}
+        state["queries"] += 1
+        state["seconds"] += seconds
+        key = template(statement)
+        state["templates"][key] = state["templates"].get(key, 0) + 1
+
+    def _finished(self, exc):
+        state = g.pop("sql_trace", None)
+        if state is None:
+            return
+        where = f"{request.method} {request.path}"
+        for key, count in state["templates"].items():
+            if count > self.repeat_limit:
+                log.warning("%s ran the same statement %d times (N+1?): %s", where, count, key)
+        log.debug("%s: %d queries, %.1f ms in SQL", where, state["queries"], state["seconds"] * 1000)
+
+    def init_app(self, app):
+        self.app = app
+        app.teardown_request(self._finished)